@@ -2,13 +2,31 @@
 # 功能: 从视频提取帧，并可选地进行缩放、效果加工和画布合成。
 # 新增: 支持两种不同的边缘效果处理顺序。
 
+APP_VERSION = "5.0"
+
 import os
+import sys
+import io
+import glob
+import argparse
+import itertools
 import subprocess
 import shutil
 import platform
 import json
 import time
-from math import floor
+import hashlib
+import zlib
+import threading
+import cProfile
+import pstats
+from contextlib import contextmanager
+import tempfile
+import atexit
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED, ALL_COMPLETED
+from math import floor, ceil
+from fractions import Fraction
+from typing import NamedTuple, Optional
 
 # --- 依赖检查 ---
 try:
@@ -16,6 +34,7 @@ try:
     from rich.panel import Panel
     from rich.text import Text
     from rich.progress import Progress, BarColumn, TextColumn, TimeRemainingColumn
+    from rich.table import Table
 except ImportError:
     print("错误: 核心界面库 rich 未安装。")
     print("请在您的终端中运行以下命令来安装它:")
@@ -31,6 +50,16 @@ except ImportError:
     exit()
 
 
+# --- 帧文件命名 ---
+# 固定 6 位补零: 超过 999 帧后文件名依旧定宽，按字典序排序即为帧序。
+FRAME_NAME_DIGITS = 6
+FRAME_NAME_PATTERN = f"%0{FRAME_NAME_DIGITS}d.png"
+
+def frame_filename(index):
+    """返回第 index 帧 (从 0 开始) 的输出文件名"""
+    return f"{index:0{FRAME_NAME_DIGITS}d}.png"
+
+
 # --- 全局辅助函数 ---
 
 def clear_screen():
@@ -41,21 +70,6 @@ def check_ffmpeg():
     """检查 FFmpeg 是否已安装"""
     return shutil.which("ffmpeg") is not None and shutil.which("ffprobe") is not None
 
-def get_video_dimensions(video_path, console):
-    """使用 ffprobe 获取视频的原始宽度和高度"""
-    try:
-        command = [
-            'ffprobe', '-v', 'error', '-select_streams', 'v:0',
-            '-show_entries', 'stream=width,height', '-of', 'csv=s=x:p=0', video_path
-        ]
-        result = subprocess.check_output(command).decode('utf-8').strip()
-        width, height = map(int, result.split('x'))
-        return width, height
-    except Exception as e:
-        console.print(f"[red]错误：无法获取视频尺寸。请检查文件路径和 FFprobe 是否正常。[/red]")
-        console.print(f"[dim]{e}[/dim]")
-        return None, None
-
 def hex_to_rgb(hex_color):
     """将 #RRGGBB 格式的十六进制颜色转为 (R, G, B) 元组"""
     try:
@@ -69,96 +83,582 @@ def ease_in_out_cubic(t):
     """一个标准的缓入缓出函数，t的取值范围为 0.0 到 1.0"""
     return t * t * (3.0 - 2.0 * t)
 
-def apply_effects_to_image(image_path, processing_settings, console):
-    """重构版: 根据指定顺序，对图片应用综合效果"""
+# --- 视频元数据 ---
+# 一次 JSON 格式的 ffprobe 取得全部所需信息，结果按 (路径, 大小, 修改时间) 缓存在内存与磁盘上，
+# 批处理、预览与各处理步骤都不会重复探测同一个文件。
+PROBE_CACHE_PATH = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser("~"), ".cache"), "picopico", "probe_cache.json")
+_PROBE_CACHE_LIMIT = 256
+_PROBE_CACHE = {}
+
+class VideoMetadata(NamedTuple):
+    """首个视频流的元数据；width / height 为按旋转角校正后的显示尺寸 (ffmpeg 解码时默认自动旋转)"""
+    width: int
+    height: int
+    coded_width: int
+    coded_height: int
+    rotation: int # 顺时针角度: 0 / 90 / 180 / 270
+    fps: float
+    frame_count: Optional[int] # 容器未记录帧数时按 时长 x 帧率 估算
+    duration: Optional[float]
+    codec: str
+    pix_fmt: str
+
+def _video_identity(video_path):
+    """以 (绝对路径, 大小, 修改时间) 标识视频，文件被替换后缓存自动失效"""
+    stat = os.stat(video_path)
+    return (os.path.abspath(video_path), stat.st_size, stat.st_mtime)
+
+def _parse_frame_rate(value):
+    """解析 ffprobe 的分数形式帧率 (如 30000/1001)，无效时返回 0.0"""
+    try:
+        numerator, _, denominator = (value or '0').partition('/')
+        return float(numerator) / float(denominator or 1)
+    except (ValueError, ZeroDivisionError): return 0.0
+
+def _parse_probe_output(data):
+    """把 ffprobe 的 JSON 输出转为 VideoMetadata"""
+    if not data.get('streams'): raise RuntimeError("文件中没有视频流")
+    stream, container = data['streams'][0], data.get('format', {})
+    rotation = 0
+    for side_data in stream.get('side_data_list', []):
+        if 'rotation' in side_data: rotation = -int(float(side_data['rotation'])) # 显示矩阵的角度为逆时针
+    if not rotation and 'rotate' in stream.get('tags', {}): rotation = int(stream['tags']['rotate']) # 旧版 ffprobe
+    rotation %= 360
+    coded_width, coded_height = int(stream['width']), int(stream['height'])
+    width, height = (coded_height, coded_width) if rotation in (90, 270) else (coded_width, coded_height)
+    fps = _parse_frame_rate(stream.get('avg_frame_rate')) or _parse_frame_rate(stream.get('r_frame_rate'))
+    duration = container.get('duration') or stream.get('duration')
+    duration = float(duration) if duration not in (None, 'N/A') else None
+    frame_count = int(stream['nb_frames']) if str(stream.get('nb_frames', '')).isdigit() and int(stream['nb_frames']) > 0 else None
+    if frame_count is None and duration and fps: frame_count = round(duration * fps)
+    return VideoMetadata(width, height, coded_width, coded_height, rotation, round(fps, 3), frame_count, duration, stream.get('codec_name', ''), stream.get('pix_fmt', ''))
+
+def _load_probe_cache():
+    try:
+        with open(PROBE_CACHE_PATH, 'r', encoding='utf-8') as f: return json.load(f)
+    except (OSError, ValueError): return {}
+
+def _save_probe_cache(identity, metadata):
+    """写回磁盘缓存 (读取-合并-原子替换，多个批处理进程同时写入时最多丢失个别条目)"""
+    path, size, mtime = identity
+    try:
+        cache = _load_probe_cache()
+        cache.pop(path, None)
+        cache[path] = {'size': size, 'mtime': mtime, 'metadata': metadata._asdict()}
+        while len(cache) > _PROBE_CACHE_LIMIT: cache.pop(next(iter(cache)))
+        os.makedirs(os.path.dirname(PROBE_CACHE_PATH), exist_ok=True)
+        temp_path = f"{PROBE_CACHE_PATH}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f: json.dump(cache, f, ensure_ascii=False)
+        os.replace(temp_path, PROBE_CACHE_PATH)
+    except OSError: pass # 缓存只是加速手段，写入失败不影响处理
+
+def probe_video(video_path):
+    """返回视频的 VideoMetadata (带缓存)；探测失败时抛出 RuntimeError"""
+    identity = _video_identity(video_path)
+    metadata = _PROBE_CACHE.get(identity)
+    if metadata is not None: return metadata
+    entry = _load_probe_cache().get(identity[0])
+    if entry and entry.get('size') == identity[1] and entry.get('mtime') == identity[2]:
+        try: metadata = VideoMetadata(**entry['metadata'])
+        except TypeError: metadata = None # 旧版本写入的条目
+    if metadata is None:
+        command = ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_streams', '-show_format', '-of', 'json', video_path]
+        try: output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        except (subprocess.CalledProcessError, OSError) as e: raise RuntimeError(f"ffprobe 无法读取视频: {getattr(e, 'stderr', None) or e}") from e
+        try: metadata = _parse_probe_output(json.loads(output))
+        except (ValueError, KeyError) as e: raise RuntimeError(f"无法解析 ffprobe 输出: {e}") from e
+        _save_probe_cache(identity, metadata)
+    if len(_PROBE_CACHE) >= _PROBE_CACHE_LIMIT: _PROBE_CACHE.pop(next(iter(_PROBE_CACHE)))
+    _PROBE_CACHE[identity] = metadata
+    return metadata
+
+def describe_video(metadata):
+    """一行文字描述视频元数据，用于菜单与日志"""
+    parts = [metadata.codec or '未知编码', f"{metadata.fps:g} fps" if metadata.fps else None, f"约 {metadata.frame_count} 帧" if metadata.frame_count else None,
+             f"{metadata.duration:.2f} 秒" if metadata.duration else None, f"旋转 {metadata.rotation}°" if metadata.rotation else None]
+    return "，".join(p for p in parts if p)
+
+# --- 运行指标 ---
+# 每个线程 (即每个任务) 独立收集: 逐帧各阶段耗时、各步骤耗时与写出字节数；进程池中的子进程按批次回传后合并。
+RUN_REPORT_NAME = "picopico_run_report.json"
+PROFILE_OUTPUT_NAME = "picopico_profile.prof"
+_METRICS_LOCAL = threading.local()
+
+def reset_metrics():
+    _METRICS_LOCAL.data = {'frame_stages': {}, 'steps': {}, 'bytes_written': {}}
+
+def _metrics():
+    if not hasattr(_METRICS_LOCAL, 'data'): reset_metrics()
+    return _METRICS_LOCAL.data
+
+@contextmanager
+def stage_timer(stage):
+    """记录一次逐帧操作 (decode / mask / composite / encode) 的耗时"""
+    started = time.perf_counter()
+    try: yield
+    finally: _metrics()['frame_stages'].setdefault(stage, []).append(time.perf_counter() - started)
+
+@contextmanager
+def step_timer(step):
+    """记录一个处理步骤 (extract / process / compose ...) 的总耗时"""
+    started = time.perf_counter()
+    try: yield
+    finally:
+        steps = _metrics()['steps']
+        steps[step] = steps.get(step, 0.0) + time.perf_counter() - started
+
+def record_bytes_written(kind, path):
+    """累计写出的字节数，kind 为 intermediate (临时帧) 或 output (成品)"""
+    written = _metrics()['bytes_written']
+    written[kind] = written.get(kind, 0) + os.path.getsize(path)
+
+def metrics_snapshot():
+    return _metrics()
+
+def merge_metrics(snapshot):
+    """合并子进程回传的指标"""
+    data = _metrics()
+    for stage, samples in snapshot['frame_stages'].items(): data['frame_stages'].setdefault(stage, []).extend(samples)
+    for step, seconds in snapshot['steps'].items(): data['steps'][step] = data['steps'].get(step, 0.0) + seconds
+    for kind, count in snapshot['bytes_written'].items(): data['bytes_written'][kind] = data['bytes_written'].get(kind, 0) + count
+
+def _percentile(sorted_values, percent):
+    """最近秩法求百分位数"""
+    if not sorted_values: return None
+    return sorted_values[min(len(sorted_values) - 1, max(0, ceil(percent / 100 * len(sorted_values)) - 1))]
+
+def summarize_frame_stages():
+    """汇总逐帧阶段耗时: 次数、总耗时与 p50/p95 单帧延迟 (毫秒)"""
+    summary = {}
+    for stage, samples in _metrics()['frame_stages'].items():
+        ordered = sorted(samples)
+        summary[stage] = {'count': len(ordered), 'total_seconds': round(sum(ordered), 4),
+                          'p50_ms': round(_percentile(ordered, 50) * 1000, 3), 'p95_ms': round(_percentile(ordered, 95) * 1000, 3)}
+    return summary
+
+def write_run_report(settings, wall_seconds, success):
+    """在输出目录写出本次运行的机器可读报告"""
+    data = _metrics()
+    report = {'app_version': APP_VERSION, 'input': settings['paths']['input'], 'output': settings['paths']['output'], 'mode': settings['execution']['mode'],
+              'workers': settings['execution']['workers'], 'output_format': settings['output']['format'], 'compress_level': settings['output']['compress_level'], 'success': success, 'wall_seconds': round(wall_seconds, 4),
+              'steps': {step: round(seconds, 4) for step, seconds in data['steps'].items()}, 'frame_stages': summarize_frame_stages(), 'bytes_written': data['bytes_written'],
+              'preflight': data.get('preflight')}
+    os.makedirs(settings['paths']['output'], exist_ok=True)
+    report_path = os.path.join(settings['paths']['output'], RUN_REPORT_NAME)
+    with open(report_path, 'w', encoding='utf-8') as f: json.dump(report, f, ensure_ascii=False, indent=2)
+    return report_path
+
+# --- 输出编码 ---
+# 成品帧统一经由编码器写出: PNG (可选压缩级别)、全视频共享调色板的 8 位 PNG、无损 WebP；
+# 动画格式则先写出逐帧 PNG / WebP，全部完成后直接复用逐帧的压缩数据拼接为单个 APNG 或动画 WebP 文件。
+OUTPUT_FORMAT_LABELS = {'png': 'PNG', 'palette': '8 位调色板 PNG', 'webp': '无损 WebP', 'apng': 'APNG 动画 (单文件)', 'awebp': '动画 WebP (单文件)'}
+ANIMATION_FILENAMES = {'apng': "animation.apng", 'awebp': "animation.webp"}
+_FRAME_EXTENSIONS = {'png': '.png', 'palette': '.png', 'webp': '.webp', 'apng': '.png', 'awebp': '.webp'}
+DEFAULT_COMPRESS_LEVEL = 6 # 与 Pillow 保存 PNG 时的默认级别一致
+FAST_COMPRESS_LEVEL = 1 # 中间帧随后还会被解码，只求编码快
+PALETTE_SAMPLE_FRAMES = 8
+PALETTE_ALPHA_STEPS = 6 # 半透明像素按 Alpha 分为几层
+PALETTE_LEVEL_COLORS = 16 # 每个半透明层分配的颜色数
+INTERMEDIATE_ENCODER = {'format': 'png', 'compress_level': FAST_COMPRESS_LEVEL, 'palette': None, 'final': False}
+
+def output_frame_name(filename, output_settings):
+    """按输出格式返回成品帧的文件名 (扩展名随格式变化)"""
+    return os.path.splitext(filename)[0] + _FRAME_EXTENSIONS[output_settings['format']]
+
+def is_frame_file(filename):
+    """是否为按帧号命名的成品帧文件"""
+    stem, ext = os.path.splitext(filename)
+    return stem.isdigit() and ext in ('.png', '.webp')
+
+def _alpha_level(alpha):
+    """Alpha 分层: 0 为全透明，PALETTE_ALPHA_STEPS + 1 为不透明，其余为半透明层"""
+    if alpha == 0: return 0
+    if alpha == 255: return PALETTE_ALPHA_STEPS + 1
+    return 1 + (alpha - 1) * PALETTE_ALPHA_STEPS // 254
+
+def build_shared_palette(samples):
+    """由样本帧构建全视频共享的 RGBA 调色板
+    索引 0 为全透明，不透明像素占用大部分颜色，每个半透明层各分配少量颜色。逐帧量化时只做一次 RGB 最近色查找，
+    半透明像素再经查找表映射到所在层的颜色，因此每帧开销与普通的调色板量化相当。"""
+    opaque_level = PALETTE_ALPHA_STEPS + 1
+    level_colors, level_alpha = {}, {}
+    for sample in samples:
+        sample = sample.convert('RGBA')
+        for count, (r, g, b, a) in sample.getcolors(sample.width * sample.height):
+            level = _alpha_level(a)
+            if level == 0: continue
+            level_colors.setdefault(level, []).append((count, bytes((r, g, b))))
+            total, weight = level_alpha.get(level, (0, 0))
+            level_alpha[level] = (total + a * count, weight + count)
+    def quantize_colors(colors, count):
+        data = b''.join(rgb * n for n, rgb in colors) or bytes(3)
+        palette = Image.frombytes('RGB', (len(data) // 3, 1), data).quantize(count, method=Image.Quantize.MEDIANCUT).getpalette()
+        return [tuple(palette[i:i + 3]) for i in range(0, len(palette), 3)][:count]
+    partial_levels = sorted(level for level in level_colors if level != opaque_level)
+    opaque_colors = quantize_colors(level_colors.get(opaque_level) or [c for colors in level_colors.values() for c in colors], 255 - PALETTE_LEVEL_COLORS * len(partial_levels))
+    opaque_palette = Image.new('P', (1, 1))
+    opaque_palette.putpalette([v for rgb in opaque_colors for v in rgb])
+    rgba_palette = [0, 0, 0, 0] + [v for rgb in opaque_colors for v in (*rgb, 255)]
+    luts = {opaque_level: list(range(1, len(opaque_colors) + 1)) + [0] * (256 - len(opaque_colors))}
+    for level in partial_levels:
+        colors = quantize_colors(level_colors[level], PALETTE_LEVEL_COLORS)
+        offset = len(rgba_palette) // 4
+        total, weight = level_alpha[level]
+        rgba_palette.extend(v for rgb in colors for v in (*rgb, round(total / weight)))
+        nearest = [min(range(len(colors)), key=lambda j: sum((x - y) ** 2 for x, y in zip(colors[j], rgb))) for rgb in opaque_colors]
+        luts[level] = [offset + j for j in nearest] + [0] * (256 - len(nearest))
+    # 样本中未出现的半透明层就近归入已有的层 (全透明层总是存在)
+    available = [0, *luts]
+    alpha_lut = [min(available, key=lambda level: abs(level - _alpha_level(a))) for a in range(256)]
+    return {'opaque': opaque_palette, 'luts': luts, 'alpha_lut': alpha_lut, 'rgba': rgba_palette}
+
+def quantize_to_palette(img, palette):
+    """按共享调色板把单帧量化为 8 位带透明度的调色板图像"""
+    rgba = img.convert('RGBA')
+    indices = Image.frombytes('L', rgba.size, rgba.convert('RGB').quantize(palette=palette['opaque'], dither=Image.Dither.NONE).tobytes())
+    levels = rgba.getchannel('A').point(palette['alpha_lut'])
+    histogram = levels.histogram()
+    result = Image.new('L', rgba.size, 0)
+    for level, lut in palette['luts'].items():
+        if histogram[level]: result.paste(indices.point(lut), mask=levels.point([255 if v == level else 0 for v in range(256)]))
+    quantized = Image.frombytes('P', rgba.size, result.tobytes())
+    quantized.putpalette(palette['rgba'], rawmode='RGBA')
+    return quantized
+
+def _sample_output_frames(settings, count=PALETTE_SAMPLE_FRAMES):
+    """在提取时间窗口内均匀选取若干时间点，按当前参数完成加工与合成后缩小，作为构建调色板的样本
+    与预览共用解码: 每个时间点在输入端单独定位并只解码一帧，不必解码整个窗口。"""
+    duration = probe_video(settings['paths']['input']).duration
+    start, end = extraction_window(settings, duration)
+    timestamps = window_timestamps(settings, duration, count) if duration or end is not None else [start]
+    samples = []
+    for frame_img in render_preview_frames(settings, timestamps, cache=False)[0]:
+        frame_img = frame_img.copy() # 结果可能来自预览缓存，不能原地缩小
+        frame_img.thumbnail((256, 256), Image.NEAREST) # 最近邻缩小不会引入新的颜色
+        samples.append(frame_img)
+    return samples
+
+def build_output_encoder(settings):
+    """根据输出设置构建编码器；调色板格式会先抽样构建全视频共享的调色板"""
+    output_settings = settings['output']
+    palette = build_shared_palette(_sample_output_frames(settings)) if output_settings['format'] == 'palette' else None
+    final = output_settings['format'] not in ANIMATION_FILENAMES and not settings['atlas']['enabled']
+    return {'format': output_settings['format'], 'compress_level': output_settings['compress_level'], 'palette': palette, 'final': final}
+
+def _save_encoded(img, fp, encoder):
+    """按编码器把单帧写入文件路径或文件对象"""
+    level = encoder['compress_level']
+    if encoder['format'] == 'palette': quantize_to_palette(img, encoder['palette']).save(fp, "PNG", compress_level=level)
+    elif encoder['format'] in ('webp', 'awebp'): img.save(fp, "WEBP", lossless=True, quality=round(level * 100 / 9), method=round(level * 6 / 9))
+    else: img.save(fp, "PNG", compress_level=level) # PNG / APNG: 动画的逐帧压缩数据会被原样拼入
+
+def encode_frame(img, path, encoder):
+    """按编码器写出单帧，并记录编码耗时与写出字节数"""
+    with stage_timer('encode'): _save_encoded(img, path, encoder)
+    record_bytes_written('output' if encoder['final'] else 'intermediate', path)
+
+def _reencode_file(source_path, output_path, encoder):
+    """解码单帧并按编码器重新写出，目标文件名不同时删除源文件"""
+    with stage_timer('decode'):
+        img = Image.open(source_path)
+        img.load()
+    encode_frame(img, output_path, encoder)
+    if output_path != source_path: os.remove(source_path)
+
+def _output_frame_sequence(output_folder):
+    """按帧号顺序返回输出目录中的 [(帧文件名, 对应的图片文件名)]；存在重复帧索引时以索引为准"""
+    index_path = os.path.join(output_folder, DEDUP_INDEX_NAME)
+    if os.path.isfile(index_path):
+        with open(index_path, 'r', encoding='utf-8') as f: return [(entry['frame'], entry['image']) for entry in json.load(f)['frames']]
+    return [(f, f) for f in sorted(os.listdir(output_folder)) if is_frame_file(f)]
+
+def _remove_frame_files(output_folder):
+    """逐帧图片已被打包为单个文件后，删除逐帧文件与重复帧索引"""
+    for f in os.listdir(output_folder):
+        if is_frame_file(f): os.remove(os.path.join(output_folder, f))
+    index_path = os.path.join(output_folder, DEDUP_INDEX_NAME)
+    if os.path.isfile(index_path): os.remove(index_path)
+
+def _png_chunks(data):
+    """把 PNG 数据拆分为 [(块类型, 块内容)]"""
+    chunks, pos = [], 8
+    while pos < len(data):
+        length = int.from_bytes(data[pos:pos + 4], 'big')
+        chunks.append((data[pos + 4:pos + 8], data[pos + 8:pos + 8 + length]))
+        pos += 12 + length
+    return chunks
+
+def _write_png_chunk(f, chunk_type, payload):
+    f.write(len(payload).to_bytes(4, 'big') + chunk_type + payload + zlib.crc32(chunk_type + payload).to_bytes(4, 'big'))
+
+def _apng_delay(repeat, rate):
+    """fcTL 帧延时 repeat / rate 秒，返回 16 位的 (分子, 分母)；精确值放不下时 (如 120000/1001 fps) 取分母受限的最接近分数"""
+    numerator, denominator = repeat * rate.denominator, rate.numerator
+    if numerator <= 0xFFFF and denominator <= 0xFFFF: return numerator, denominator
+    delay = Fraction(numerator, denominator)
+    max_denominator = max(1, min(0xFFFF, floor(0xFFFF / delay)))
+    approx = delay.limit_denominator(max_denominator)
+    while approx.numerator > 0xFFFF and max_denominator > 1:
+        max_denominator -= 1; approx = delay.limit_denominator(max_denominator)
+    return min(approx.numerator, 0xFFFF), approx.denominator
+
+def write_apng(path, frames, fps):
+    """流式写出 APNG: frames 为 [(逐帧 PNG 路径, 显示帧数)]
+    每帧都是完整画面 (dispose=NONE, blend=SOURCE)，IDAT 数据直接转为 fdAT，无需重新解码与编码，内存中只保留一帧。"""
+    rate = Fraction(fps) # 帧延时 = 显示帧数 / 帧率，分数帧率 (如每 N 帧取 1 帧) 也能精确表示
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        header, sequence = None, 0
+        for image_path, repeat in frames:
+            with open(image_path, 'rb') as frame_file: chunks = _png_chunks(frame_file.read())
+            frame_header = dict(chunks)[b'IHDR']
+            if header is None:
+                header = frame_header
+                _write_png_chunk(f, b'IHDR', header)
+                _write_png_chunk(f, b'acTL', len(frames).to_bytes(4, 'big') + (0).to_bytes(4, 'big')) # 无限循环
+                for chunk_type, payload in chunks:
+                    if chunk_type in (b'PLTE', b'tRNS'): _write_png_chunk(f, chunk_type, payload)
+            elif frame_header != header: raise ValueError(f"帧格式与首帧不一致: {os.path.basename(image_path)}")
+            delay_num, delay_den = _apng_delay(repeat, rate)
+            _write_png_chunk(f, b'fcTL', sequence.to_bytes(4, 'big') + header[:8] + bytes(8) + delay_num.to_bytes(2, 'big') + delay_den.to_bytes(2, 'big') + bytes(2))
+            sequence += 1
+            for chunk_type, payload in chunks:
+                if chunk_type != b'IDAT': continue
+                if sequence == 1: _write_png_chunk(f, b'IDAT', payload) # 首帧同时作为静态 PNG 的默认图像
+                else:
+                    _write_png_chunk(f, b'fdAT', sequence.to_bytes(4, 'big') + payload)
+                    sequence += 1
+        _write_png_chunk(f, b'IEND', b'')
+
+def _riff_chunks(data):
+    """把 WebP (RIFF) 数据拆分为 [(块类型, 块内容)]"""
+    chunks, pos = [], 12
+    while pos + 8 <= len(data):
+        length = int.from_bytes(data[pos + 4:pos + 8], 'little')
+        chunks.append((data[pos:pos + 4], data[pos + 8:pos + 8 + length]))
+        pos += 8 + length + (length & 1)
+    return chunks
+
+def _riff_chunk(chunk_type, payload):
+    return chunk_type + len(payload).to_bytes(4, 'little') + payload + bytes(len(payload) & 1)
+
+def write_animated_webp(path, frames, fps):
+    """流式写出动画 WebP: frames 为 [(逐帧 WebP 路径, 显示帧数)]
+    与 APNG 相同，逐帧的 VP8L 压缩数据直接装入 ANMF 块 (不混合、不清除)，帧时长按累计时间取整到毫秒，避免误差累积。"""
+    with open(path, 'wb') as f:
+        f.write(b'RIFF' + bytes(4) + b'WEBP') # 文件长度在写完后回填
+        canvas, elapsed = None, 0
+        for image_path, repeat in frames:
+            with Image.open(image_path) as frame_img: size = frame_img.size
+            if canvas is None:
+                canvas = size
+                f.write(_riff_chunk(b'VP8X', bytes([0x12, 0, 0, 0]) + (size[0] - 1).to_bytes(3, 'little') + (size[1] - 1).to_bytes(3, 'little'))) # 动画 + Alpha
+                f.write(_riff_chunk(b'ANIM', bytes(4) + (0).to_bytes(2, 'little'))) # 透明背景，无限循环
+            elif size != canvas: raise ValueError(f"帧尺寸与首帧不一致: {os.path.basename(image_path)}")
+            with open(image_path, 'rb') as frame_file: chunks = _riff_chunks(frame_file.read())
+            # 单帧文件可能是简单格式 (VP8L)，也可能是扩展格式 (ALPH + VP8) 或只含一帧的动画 (ANMF)
+            anmf = [payload[16:] for chunk_type, payload in chunks if chunk_type == b'ANMF']
+            bitstream = anmf[0] if anmf else b''.join(_riff_chunk(chunk_type, payload) for chunk_type, payload in chunks if chunk_type in (b'ALPH', b'VP8 ', b'VP8L'))
+            duration = round((elapsed + repeat) * 1000 / fps) - round(elapsed * 1000 / fps)
+            elapsed += repeat
+            f.write(_riff_chunk(b'ANMF', bytes(6) + (size[0] - 1).to_bytes(3, 'little') + (size[1] - 1).to_bytes(3, 'little') + min(duration, 0xFFFFFF).to_bytes(3, 'little') + bytes([0x02]) + bitstream))
+        file_size = f.tell()
+        f.seek(4)
+        f.write((file_size - 8).to_bytes(4, 'little'))
+
+def assemble_animation(settings, console, manifest=None):
+    """把输出目录中的逐帧图片按帧率拼接为单个 APNG / 动画 WebP，完成后删除逐帧文件"""
+    output_folder = settings['paths']['output']
+    output_settings = settings['output']
+    frames = [image for _, image in _output_frame_sequence(output_folder)]
+    if not frames:
+        console.print("[bold red]没有可拼接的帧！[/bold red]"); return False
+    console.print(f"[yellow]拼接 {OUTPUT_FORMAT_LABELS[output_settings['format']]}...[/yellow]")
+    # 连续相同的帧 (重复帧检测的结果) 合并为一帧并累加显示时长
+    entries = []
+    for image in frames:
+        if entries and entries[-1][0] == image: entries[-1][1] += 1
+        else: entries.append([image, 1])
+    animation_name = ANIMATION_FILENAMES[output_settings['format']]
+    animation_path = os.path.join(output_folder, animation_name)
+    writer = write_apng if output_settings['format'] == 'apng' else write_animated_webp
+    try: writer(animation_path, [(os.path.join(output_folder, image), repeat) for image, repeat in entries], extraction_frame_rate(settings))
+    except (OSError, ValueError) as e:
+        console.print(f"\n[bold red]动画拼接失败！[/bold red] {e}"); return False
+    record_bytes_written('output', animation_path)
+    _remove_frame_files(output_folder)
+    if manifest is not None: manifest['done'] = {animation_name}
+    console.print(f"[green]动画已保存: {animation_path} ({os.path.getsize(animation_path) / 1024:.1f} KB)[/green]")
+    return True
+
+# --- 精灵图集 ---
+# 游戏与网页运行时逐个打开成千上万张 PNG 很慢: 每帧先裁掉四周的透明区域，再按行 (shelf) 依次装入尺寸受限的图集，
+# 并写出记录每帧所在图集、矩形与偏移的索引。像素完全相同的帧共用同一个位置。
+ATLAS_INDEX_NAME = "atlas.json"
+ATLAS_PAGE_PATTERN = "atlas_{:02d}"
+ATLAS_PADDING = 2 # 相邻帧之间的透明间隔，避免纹理过滤时串色
+DEFAULT_ATLAS_SIZE = 4096 # 常见 GPU 都支持的最大纹理边长
+
+def trim_transparent(img):
+    """裁剪到非透明像素的包围盒，返回 (裁剪后的图像, 包围盒)；整帧透明时返回 (None, None)"""
+    if img.mode not in ('RGBA', 'LA', 'P'): return img, (0, 0, img.width, img.height)
+    bbox = (img if img.mode == 'RGBA' else img.convert('RGBA')).getchannel('A').getbbox()
+    if bbox is None: return None, None
+    return (img if bbox == (0, 0, img.width, img.height) else img.crop(bbox)), bbox
+
+def _new_atlas_page(template, width, height):
+    """按帧的模式新建空白图集页: 调色板帧沿用同一调色板 (索引 0 为透明)，其余为透明 RGBA 或黑色 RGB"""
+    if template.mode == 'P':
+        page = Image.new('P', (width, height), 0)
+        page.putpalette(template.getpalette())
+        if 'transparency' in template.info: page.info['transparency'] = template.info['transparency']
+        return page
+    return Image.new('RGB' if template.mode == 'RGB' else 'RGBA', (width, height))
+
+def build_atlas(settings, console, manifest=None):
+    """把输出目录中的逐帧图片裁剪透明边后打包为若干张图集并写出索引，完成后删除逐帧文件"""
+    output_folder = settings['paths']['output']
+    output_settings = settings['output']
+    max_size = settings['atlas']['max_size']
+    frames = _output_frame_sequence(output_folder)
+    if not frames:
+        console.print("[bold red]没有可打包的帧！[/bold red]"); return False
+    page_ext = _FRAME_EXTENSIONS[output_settings['format']]
+    encoder = {'format': 'webp' if page_ext == '.webp' else 'png', 'compress_level': output_settings['compress_level'], 'palette': None, 'final': True}
+    pages, slots, entries = [], {}, []
+    page, frame_size = None, None
+    x = y = shelf_height = used_width = used_height = 0
+    def flush_page():
+        page_name = ATLAS_PAGE_PATTERN.format(len(pages)) + page_ext
+        encode_frame(page.crop((0, 0, used_width, used_height)), os.path.join(output_folder, page_name), encoder)
+        pages.append({'image': page_name, 'width': used_width, 'height': used_height})
+    with Progress(TextColumn("[progress.description]{task.description}"), BarColumn(), TextColumn("[progress.percentage]{task.percentage:>3.0f}%"), TimeRemainingColumn(), console=console) as progress:
+        task = progress.add_task("[green]打包精灵图集...", total=len(frames))
+        for frame_name, image in frames:
+            with stage_timer('decode'):
+                frame_img = Image.open(os.path.join(output_folder, image))
+                frame_img.load()
+            frame_size = frame_size or frame_img.size
+            trimmed, bbox = trim_transparent(frame_img)
+            entry = {'frame': os.path.splitext(frame_name)[0], 'page': None, 'x': 0, 'y': 0, 'w': 0, 'h': 0, 'offset_x': 0, 'offset_y': 0}
+            if trimmed is not None:
+                digest = hashlib.sha1(f"{trimmed.mode}{bbox}".encode('ascii') + trimmed.tobytes()).hexdigest()
+                if digest not in slots:
+                    w, h = trimmed.size
+                    if page is not None and x + w > page.width: x, y, shelf_height = 0, y + shelf_height + ATLAS_PADDING, 0 # 换行
+                    if page is None or y + h > page.height or w > page.width:
+                        if page is not None: flush_page()
+                        page = _new_atlas_page(frame_img, max(max_size, w), max(max_size, h)) # 超过上限的帧单独占用一张放大的图集
+                        x = y = shelf_height = used_width = used_height = 0
+                    page.paste(trimmed, (x, y))
+                    slots[digest] = {'page': len(pages), 'x': x, 'y': y, 'w': w, 'h': h}
+                    used_width, used_height = max(used_width, x + w), max(used_height, y + h)
+                    x, shelf_height = x + w + ATLAS_PADDING, max(shelf_height, h)
+                entry.update(slots[digest], offset_x=bbox[0], offset_y=bbox[1])
+            entries.append(entry)
+            progress.update(task, advance=1)
+    if page is not None: flush_page()
+    rate = extraction_frame_rate(settings)
+    index = {'frame_size': list(frame_size), 'fps': round(float(rate), 3) if isinstance(rate, Fraction) else rate, 'padding': ATLAS_PADDING, 'pages': pages,
+             'frame_count': len(entries), 'unique_count': len(slots), 'frames': entries}
+    with open(os.path.join(output_folder, ATLAS_INDEX_NAME), 'w', encoding='utf-8') as f: json.dump(index, f, ensure_ascii=False, indent=1)
+    _remove_frame_files(output_folder)
+    if manifest is not None: manifest['done'] = {page['image'] for page in pages} | {ATLAS_INDEX_NAME}
+    console.print(f"[green]已将 {len(entries)} 帧 (唯一 {len(slots)} 帧) 打包为 {len(pages)} 张图集，索引: {ATLAS_INDEX_NAME}[/green]")
+    return True
+
+# --- 效果蒙版缓存 ---
+# 同一次任务中所有帧的尺寸与加工参数都相同，最终蒙版只需构建一次，之后逐帧复用。
+_MASK_CACHE = {}
+_MASK_CACHE_LIMIT = 16
+
+def _ease_ramp(length, reverse=False):
+    """生成长度为 length 的缓入缓出渐变 (0-255)，结果与逐行绘制完全一致"""
+    denominator = length - 1
+    if reverse: values = [int(255 * (1 - ease_in_out_cubic(i / denominator))) for i in range(length)]
+    else: values = [int(255 * ease_in_out_cubic(i / denominator)) for i in range(length)]
+    return bytes(values)
+
+def _feather_edge_mask(width, height, edge, percent):
+    """构建单条边的虚化蒙版: 先生成一维渐变，再整体拉伸为二维，避免逐行/逐列绘制"""
+    edge_mask = Image.new("L", (width, height), 255)
+    if percent <= 0: return edge_mask
+    vertical = edge in ('top', 'bottom')
+    edge_px = int((height if vertical else width) * percent / 100)
+    if edge_px <= 1: return edge_mask
+    ramp = _ease_ramp(edge_px, reverse=edge in ('bottom', 'right'))
+    if vertical:
+        gradient = Image.frombytes("L", (1, edge_px), ramp).resize((width, edge_px), Image.NEAREST)
+        edge_mask.paste(gradient, (0, 0 if edge == 'top' else height - edge_px))
+    else:
+        gradient = Image.frombytes("L", (edge_px, 1), ramp).resize((edge_px, height), Image.NEAREST)
+        edge_mask.paste(gradient, (0 if edge == 'left' else width - edge_px, 0))
+    return edge_mask
+
+def _build_effects_mask(width, height, processing_settings):
+    """根据指定顺序，构建圆角、虚化、模糊合成后的最终 Alpha 蒙版"""
+    # 1. 圆角蒙版 (C)
+    corner_mask = Image.new("L", (width, height), 255)
+    radius_percent = processing_settings['corner_radius']
+    if radius_percent > 0:
+        shortest_side = min(width, height)
+        radius_px = int(shortest_side * radius_percent / 100)
+        if radius_px > 0:
+            corner_mask_temp = Image.new("L", (width, height), 0)
+            draw = ImageDraw.Draw(corner_mask_temp)
+            draw.rounded_rectangle((0, 0, width, height), radius=radius_px, fill=255)
+            corner_mask = corner_mask_temp
+
+    # 2. 平滑虚化蒙版 (F)
+    feather_mask_final = Image.new("L", (width, height), 255)
+    feather_settings = processing_settings['feathering']
+    if any(v > 0 for v in feather_settings.values()):
+        top_mask, bottom_mask, left_mask, right_mask = (_feather_edge_mask(width, height, edge, feather_settings[edge]) for edge in ('top', 'bottom', 'left', 'right'))
+        feather_mask_final = ImageChops.multiply(ImageChops.multiply(top_mask, bottom_mask), ImageChops.multiply(left_mask, right_mask))
+
+    # --- 按照指定顺序应用效果 ---
+    final_mask = Image.new("L", (width, height), 255)
+    order = processing_settings.get('order', 'C-F-B') # 默认为标准顺序
+    blur_strength = processing_settings['blur_strength']
+
+    if order == 'C-F-B':
+        # 顺序 A: 圆角 -> 虚化 -> 模糊 (标准柔和)
+        mask = ImageChops.multiply(final_mask, corner_mask)
+        mask = ImageChops.multiply(mask, feather_mask_final)
+        if blur_strength > 0:
+            mask = mask.filter(ImageFilter.GaussianBlur(blur_strength))
+        final_mask = mask
+    elif order == 'C-B-F':
+        # 顺序 B: 圆角 -> 模糊 -> 虚化 (轮廓感)
+        mask = ImageChops.multiply(final_mask, corner_mask)
+        if blur_strength > 0:
+            mask = mask.filter(ImageFilter.GaussianBlur(blur_strength))
+        final_mask = ImageChops.multiply(mask, feather_mask_final)
+    return final_mask
+
+def get_effects_mask(size, processing_settings):
+    """按 (宽, 高, 圆角, 虚化, 模糊, 顺序) 缓存最终蒙版，同一任务内只构建一次"""
+    width, height = size
+    feather = processing_settings['feathering']
+    key = (width, height, processing_settings['corner_radius'], (feather['top'], feather['bottom'], feather['left'], feather['right']), processing_settings['blur_strength'], processing_settings.get('order', 'C-F-B'))
+    mask = _MASK_CACHE.get(key)
+    if mask is None:
+        if len(_MASK_CACHE) >= _MASK_CACHE_LIMIT: _MASK_CACHE.pop(next(iter(_MASK_CACHE)))
+        mask = _MASK_CACHE[key] = _build_effects_mask(width, height, processing_settings)
+    return mask
+
+def _apply_effects_file(image_path, processing_settings, encoder=INTERMEDIATE_ENCODER):
+    """对单个图片文件应用综合效果并按编码器写回 (扩展名可能随格式变化)，失败时抛出异常"""
+    with stage_timer('decode'): img = Image.open(image_path).convert("RGBA")
+    with stage_timer('mask'): img.putalpha(get_effects_mask(img.size, processing_settings))
+    output_path = os.path.join(os.path.dirname(image_path), output_frame_name(os.path.basename(image_path), encoder))
+    encode_frame(img, output_path, encoder)
+    if output_path != image_path: os.remove(image_path)
+
+def apply_effects_to_image(image_path, processing_settings, console, encoder=INTERMEDIATE_ENCODER):
+    """重构版: 根据指定顺序，对图片应用综合效果 (蒙版来自缓存)"""
     try:
-        img = Image.open(image_path).convert("RGBA")
-        width, height = img.size
-
-        # --- 预先生成所有效果需要的基础蒙版 ---
-        # 1. 圆角蒙版 (C)
-        corner_mask = Image.new("L", (width, height), 255)
-        radius_percent = processing_settings['corner_radius']
-        if radius_percent > 0:
-            shortest_side = min(width, height)
-            radius_px = int(shortest_side * radius_percent / 100)
-            if radius_px > 0:
-                corner_mask_temp = Image.new("L", (width, height), 0)
-                draw = ImageDraw.Draw(corner_mask_temp)
-                draw.rounded_rectangle((0, 0, width, height), radius=radius_px, fill=255)
-                corner_mask = corner_mask_temp
-        
-        # 2. 平滑虚化蒙版 (F)
-        feather_mask_final = Image.new("L", (width, height), 255)
-        feather_settings = processing_settings['feathering']
-        if any(v > 0 for v in feather_settings.values()):
-            top_mask = Image.new("L", (width, height), 255)
-            if feather_settings['top'] > 0:
-                top_px = int(height * feather_settings['top'] / 100)
-                if top_px > 1:
-                    top_gradient = Image.new("L", (width, top_px))
-                    denominator = top_px - 1
-                    for y in range(top_px):
-                        alpha = int(255 * ease_in_out_cubic(y / denominator))
-                        ImageDraw.Draw(top_gradient).line([(0, y), (width, y)], fill=alpha)
-                    top_mask.paste(top_gradient, (0, 0))
-
-            bottom_mask = Image.new("L", (width, height), 255)
-            if feather_settings['bottom'] > 0:
-                bottom_px = int(height * feather_settings['bottom'] / 100)
-                if bottom_px > 1:
-                    bottom_gradient = Image.new("L", (width, bottom_px))
-                    denominator = bottom_px - 1
-                    for y in range(bottom_px):
-                        alpha = int(255 * (1 - ease_in_out_cubic(y / denominator)))
-                        ImageDraw.Draw(bottom_gradient).line([(0, y), (width, y)], fill=alpha)
-                    bottom_mask.paste(bottom_gradient, (0, height - bottom_px))
-
-            left_mask = Image.new("L", (width, height), 255)
-            if feather_settings['left'] > 0:
-                left_px = int(width * feather_settings['left'] / 100)
-                if left_px > 1:
-                    left_gradient = Image.new("L", (left_px, height))
-                    denominator = left_px - 1
-                    for x in range(left_px):
-                        alpha = int(255 * ease_in_out_cubic(x / denominator))
-                        ImageDraw.Draw(left_gradient).line([(x, 0), (x, height)], fill=alpha)
-                    left_mask.paste(left_gradient, (0, 0))
-
-            right_mask = Image.new("L", (width, height), 255)
-            if feather_settings['right'] > 0:
-                right_px = int(width * feather_settings['right'] / 100)
-                if right_px > 1:
-                    right_gradient = Image.new("L", (right_px, height))
-                    denominator = right_px - 1
-                    for x in range(right_px):
-                        alpha = int(255 * (1 - ease_in_out_cubic(x / denominator)))
-                        ImageDraw.Draw(right_gradient).line([(x, 0), (x, height)], fill=alpha)
-                    right_mask.paste(right_gradient, (width - right_px, 0))
-            
-            feather_mask_final = ImageChops.multiply(ImageChops.multiply(top_mask, bottom_mask), ImageChops.multiply(left_mask, right_mask))
-
-        # --- 按照指定顺序应用效果 ---
-        final_mask = Image.new("L", (width, height), 255)
-        order = processing_settings.get('order', 'C-F-B') # 默认为标准顺序
-        blur_strength = processing_settings['blur_strength']
-
-        if order == 'C-F-B':
-            # 顺序 A: 圆角 -> 虚化 -> 模糊 (标准柔和)
-            mask = ImageChops.multiply(final_mask, corner_mask)
-            mask = ImageChops.multiply(mask, feather_mask_final)
-            if blur_strength > 0:
-                mask = mask.filter(ImageFilter.GaussianBlur(blur_strength))
-            final_mask = mask
-        elif order == 'C-B-F':
-            # 顺序 B: 圆角 -> 模糊 -> 虚化 (轮廓感)
-            mask = ImageChops.multiply(final_mask, corner_mask)
-            if blur_strength > 0:
-                mask = mask.filter(ImageFilter.GaussianBlur(blur_strength))
-            final_mask = ImageChops.multiply(mask, feather_mask_final)
-        
-        img.putalpha(final_mask)
-        img.save(image_path, "PNG")
+        _apply_effects_file(image_path, processing_settings, encoder)
         return True
     except Exception as e:
         console.print(f"\n[red]图片效果应用失败 ({os.path.basename(image_path)}): {e}[/red]")
@@ -193,127 +693,1067 @@ def _get_scale_filter(scaling_settings, original_dims):
     elif target_h > 0: return f"scale=-1:{target_h}"
     return None
 
-def module_1_extract(settings, console):
+def _get_output_dims(scaling_settings, original_dims):
+    """计算缩放后的输出尺寸，-1 维度按 ffmpeg 的四舍五入规则推算"""
+    orig_w, orig_h = original_dims
+    scale_filter = _get_scale_filter(scaling_settings, original_dims)
+    if not scale_filter: return orig_w, orig_h
+    target_w, target_h = map(int, scale_filter[len("scale="):].split(':'))
+    if target_w < 0: target_w = (target_h * orig_w + orig_h // 2) // orig_h
+    if target_h < 0: target_h = (target_w * orig_h + orig_w // 2) // orig_w
+    return target_w, target_h
+
+# --- 帧选取 ---
+# 时间窗口用输入端 -ss / -t 快速定位，窗口之外的视频不会被解码；仅关键帧模式用 -skip_frame nokey 让解码器跳过非关键帧。
+# 选帧滤镜替代 fps 滤镜接在缩放之前 (被丢弃的帧不必缩放)，各提取路径 (经典、分段、原生、流式、有界流水线) 共用同一套参数。
+FRAME_SELECT_LABELS = {'fps': '按帧率均匀抽帧', 'nth': '每 N 帧取 1 帧', 'list': '指定帧号列表', 'keyframes': '仅关键帧'}
+FILTER_SCRIPT_THRESHOLD = 16 * 1024 # 滤镜图超过该长度 (字符) 时改用脚本文件传入
+
+def parse_frame_list(value):
+    """解析帧号列表，返回去重排序后的帧号；value 为文本 (如 "0,12,30-40") 或由帧号与 "a-b" 范围组成的列表 (批处理配置)"""
+    frames = set()
+    for part in value.replace('，', ',').split(',') if isinstance(value, str) else value:
+        if isinstance(part, bool) or not isinstance(part, (int, str)): raise ValueError(f"无效的帧号: {part!r}")
+        if isinstance(part, int):
+            frames.add(part); continue
+        part = part.strip()
+        if not part: continue
+        first, dash, last = part.partition('-')
+        frames.update(range(int(first), int(last) + 1) if dash else [int(first)])
+    if any(frame < 0 for frame in frames): raise ValueError("帧号不能为负数")
+    return sorted(frames)
+
+def extraction_window(settings, duration=None):
+    """返回提取的时间窗口 (起点秒, 终点秒)；终点为 None 表示到视频结尾 (超出已知时长的终点也视为到结尾)"""
+    ext = settings['extraction']
+    start, end = max(0.0, float(ext.get('start') or 0)), ext.get('end')
+    end = float(end) if end else None
+    if end is not None and duration and end >= duration: end = None
+    return start, end
+
+def selection_error(settings):
+    """检查帧选取参数，有误时返回错误信息"""
+    ext = settings['extraction']
+    duration = probe_video(settings['paths']['input']).duration
+    start, end = extraction_window(settings, duration)
+    if duration and start >= duration: return f"起始时间 {start:g} 秒超出视频时长 {duration:.2f} 秒。"
+    if end is not None and end <= start: return f"结束时间 {end:g} 秒必须晚于起始时间 {start:g} 秒。"
+    if ext['select'] not in FRAME_SELECT_LABELS: return f"未知的选帧方式: {ext['select']}"
+    if ext['select'] == 'nth' and ext['every_nth'] < 1: return "每 N 帧取 1 帧的 N 必须大于 0。"
+    if ext['select'] == 'list' and not ext['frames']: return "指定帧号列表模式下帧号列表不能为空。"
+    if ext['select'] == 'list' and (not isinstance(ext['frames'], list) or any(type(frame) is not int or frame < 0 for frame in ext['frames']) or ext['frames'] != sorted(set(ext['frames']))):
+        return "帧号列表必须是升序、不重复的非负整数列表。"
+    return None
+
+def extraction_frame_rate(settings):
+    """输出序列的帧率 (用于动画与图集索引): 每 N 帧取 1 帧时为源帧率的 1/N，其余模式为设置的帧率"""
+    ext = settings['extraction']
+    if ext['select'] != 'nth': return ext['fps']
+    source_fps = probe_video(settings['paths']['input']).fps
+    return Fraction(source_fps).limit_denominator(1001) / ext['every_nth'] if source_fps else ext['fps']
+
+def _window_args(settings, duration=None):
+    """时间窗口对应的输入端参数"""
+    start, end = extraction_window(settings, duration)
+    args = ['-ss', f"{start:.6f}"] if start > 0 else []
+    if end is not None: args.extend(['-t', f"{end - start:.6f}"])
+    return args
+
+def _frame_runs(frames):
+    """把升序帧号列表合并为连续区间 [(起, 止)]"""
+    runs = []
+    for frame in frames:
+        if runs and frame == runs[-1][1] + 1: runs[-1] = (runs[-1][0], frame)
+        else: runs.append((frame, frame))
+    return runs
+
+def _remove_file_quietly(path):
+    try: os.remove(path)
+    except OSError: pass
+
+def _filter_args(option, graph):
+    """返回传入滤镜图的参数 (option 为 -vf 或 -filter_complex)
+    超过 FILTER_SCRIPT_THRESHOLD 的滤镜图 (如很长的帧号列表) 写入临时脚本文件，改用 -filter_script:v / -filter_complex_script 传入，
+    避免单个命令行参数过长导致启动失败 (E2BIG)；脚本文件在程序退出时删除。"""
+    if len(graph) <= FILTER_SCRIPT_THRESHOLD: return [option, graph]
+    fd, script_path = tempfile.mkstemp(prefix="picopico_filter_", suffix=".txt")
+    with os.fdopen(fd, 'w', encoding='utf-8') as f: f.write(graph)
+    atexit.register(_remove_file_quietly, script_path)
+    return [{'-vf': '-filter_script:v', '-filter_complex': '-filter_complex_script'}[option], script_path]
+
+def extraction_plan(settings):
+    """返回 (输入端参数, 选帧滤镜列表, 输出端参数)；滤镜接在缩放滤镜之前
+    非帧率模式下按序号重写时间戳 (时间基为输出帧率)，并以同一帧率 -r 输出，避免按源帧率补帧。"""
+    ext = settings['extraction']
+    input_args = _window_args(settings, probe_video(settings['paths']['input']).duration)
+    if ext['select'] == 'fps': return input_args, [f"fps={ext['fps']}"], []
+    rate = Fraction(extraction_frame_rate(settings))
+    filters, output_args = [], ['-r', f"{rate.numerator}/{rate.denominator}"]
+    if ext['select'] == 'keyframes': input_args = ['-skip_frame', 'nokey', *input_args]
+    elif ext['select'] == 'nth': filters.append(f"select=not(mod(n\\,{ext['every_nth']}))")
+    else:
+        # 连续帧号合并为 between 区间，表达式长度随区间数而非帧数增长
+        terms = [f"eq(n\\,{first})" if first == last else f"between(n\\,{first}\\,{last})" for first, last in _frame_runs(ext['frames'])]
+        filters.append("select=" + "+".join(terms))
+        output_args.extend(['-frames:v', str(len(ext['frames']))]) # 取到最后一个指定帧后即停止解码
+    filters.extend([f"settb={rate.denominator}/{rate.numerator}", "setpts=N"])
+    return input_args, filters, output_args
+
+def expected_frame_count(settings, duration=None):
+    """预计输出的帧数；仅关键帧模式或时长未知时返回 None"""
+    ext = settings['extraction']
+    start, end = extraction_window(settings, duration)
+    length = (end if end is not None else duration or 0) - start
+    if ext['select'] == 'list': return len(ext['frames'])
+    if length <= 0 or ext['select'] == 'keyframes': return None
+    if ext['select'] == 'fps': return int(length * ext['fps'])
+    source_fps = probe_video(settings['paths']['input']).fps
+    return ceil(length * source_fps / ext['every_nth']) if source_fps else None
+
+def window_timestamps(settings, duration, count):
+    """在提取时间窗口内均匀选取 count 个时间点 (用于预览与抽样)"""
+    start, end = extraction_window(settings, duration)
+    return [round(start + t, 3) for t in preview_timestamps((end if end is not None else duration) - start, count)]
+
+def _plan_segments(duration, fps, segments):
+    """按输出帧网格把视频切分为若干段，返回 [(起始帧号, 帧数)]；最后一段帧数为 None (不设上限)，以兜住时长误差"""
+    total_frames = int(duration * fps)
+    segments = max(1, min(segments, total_frames // max(1, fps))) # 每段至少约 1 秒
+    bounds = [total_frames * k // segments for k in range(segments + 1)]
+    return [(bounds[k], bounds[k + 1] - bounds[k] if k < segments - 1 else None) for k in range(segments)]
+
+def _thread_args(settings, processes=1):
+    """限制 ffmpeg 线程数的参数，返回 (输入端参数, 输出端参数)；execution.ffmpeg_threads 为 0 时由 ffmpeg 自行决定
+    输入端参数同时限制解码与滤镜线程，需放在 -i 之前；多个 ffmpeg 进程同时运行 (分段提取) 时平分线程数。"""
+    threads = settings['execution']['ffmpeg_threads']
+    if not threads: return [], []
+    threads = str(max(1, threads // processes))
+    return ['-filter_threads', threads, '-filter_complex_threads', threads, '-threads', threads], ['-threads', threads]
+
+def _extract_command(settings, output_args, start_frame=0, frame_count=None, tail_filters=(), processes=1):
+    """构建提取用的 ffmpeg 命令，经典单进程、分段、流式/有界流水线管道与原生校验共用；output_args 为输出端参数与输出目标
+    start_frame > 0 时 (仅按帧率抽帧) 输入端 -ss 对齐到输出帧网格并预留约 1 秒的预读帧，fps 滤镜从 0 开始计时后再用 trim 丢弃预读帧，
+    从而保证首帧与整段提取时的同一帧号完全对应，分段边界既不重复也不丢帧。帧号网格从提取时间窗口的起点开始计算。"""
     input_file = settings['paths']['input']
-    temp_folder = settings['paths']['temp_extraction_folder']
-    os.makedirs(temp_folder, exist_ok=True)
-    vf_filters = []
+    input_args, select_filters, plan_args = extraction_plan(settings)
+    if start_frame > 0:
+        fps = settings['extraction']['fps']
+        window = extraction_window(settings, probe_video(input_file).duration)
+        preroll = min(start_frame, ceil(fps))
+        seek = window[0] + (start_frame - preroll) / fps
+        input_args = ['-ss', f"{seek:.6f}"] if seek > 0 else []
+        if window[1] is not None: input_args.extend(['-t', f"{window[1] - seek:.6f}"])
+        select_filters = [f"fps={fps}:start_time=0", f"trim=start_frame={preroll}"]
     scale_filter = _get_scale_filter(settings['scaling'], settings['original_dims'])
-    if scale_filter: vf_filters.append(scale_filter)
-    vf_filters.append(f"fps={settings['extraction']['fps']}")
-    console.print("[yellow]步骤 1/3: 使用 ffmpeg 提取并缩放帧...[/yellow]")
-    with console.status("[bold green]FFmpeg 正在运行...", spinner="dots"):
-        output_pattern = os.path.join(temp_folder, "%03d.png")
-        command = ['ffmpeg', '-i', input_file, '-vf', ",".join(vf_filters), '-start_number', '0', '-y', output_pattern]
+    vf_filters = select_filters + ([scale_filter] if scale_filter else []) + list(tail_filters)
+    thread_input, thread_output = _thread_args(settings, processes)
+    command = ['ffmpeg', *thread_input, *input_args, '-i', input_file, *_filter_args('-vf', ",".join(vf_filters)), *plan_args, *thread_output]
+    if frame_count is not None: command.extend(['-frames:v', str(frame_count)])
+    return command + list(output_args)
+
+def _extract_segmented(settings, output_pattern, segments, duration, console, make_callback, start_frame=0):
+    """分段并行提取: 多个 ffmpeg 进程分别解码不同时间段，帧号直接写入同一连续序列；start_frame 之前的帧不再提取"""
+    fps = settings['extraction']['fps']
+    if not duration:
+        console.print("[dim]无法获取视频时长，回退为单进程提取。[/dim]")
+        return _run_extract_command(_extract_command(settings, ['-start_number', str(start_frame), '-y', output_pattern], start_frame), console, make_callback(0))
+    window = extraction_window(settings, duration)
+    length = (window[1] if window[1] is not None else duration) - window[0]
+    plan = [(start_frame + start, count) for start, count in _plan_segments(length - start_frame / fps, fps, segments)]
+    commands = [_extract_command(settings, ['-start_number', str(start), '-y', output_pattern], start, count, processes=len(plan)) for start, count in plan]
+    with ThreadPoolExecutor(max_workers=len(commands)) as executor:
+        results = list(executor.map(lambda item: _run_extract_command(item[1], console, make_callback(item[0])), enumerate(commands)))
+    if not all(results): return False
+    # 校验帧序列连续: 任何分段边界的缺帧都会在这里暴露
+    temp_folder = os.path.dirname(output_pattern)
+    frame_files = [f for f in os.listdir(temp_folder) if f.endswith('.png')]
+    if set(frame_files) != {frame_filename(start_frame + i) for i in range(len(frame_files))}:
+        console.print("\n[bold red]分段提取的帧序列不连续！[/bold red]"); return False
+    return True
+
+def _run_extract_command(command, console, on_frames=None):
+    """运行 ffmpeg；提供 on_frames 时解析 -progress 输出，把已输出的帧数实时回调出去"""
+    if on_frames is None:
         try: subprocess.run(command, check=True, capture_output=True, text=True)
         except subprocess.CalledProcessError as e:
             console.print(f"\n[bold red]ffmpeg 提取失败！[/bold red]\n{e.stderr}"); return False
+        return True
+    command = [command[0], '-progress', 'pipe:1', '-nostats', *command[1:]]
+    with tempfile.TemporaryFile() as stderr_file:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr_file, text=True)
+        for line in process.stdout:
+            key, _, value = line.strip().partition('=')
+            if key == 'frame' and value.isdigit(): on_frames(int(value))
+        process.wait()
+        if process.returncode != 0:
+            stderr_file.seek(0)
+            console.print(f"\n[bold red]ffmpeg 提取失败！[/bold red]\n{stderr_file.read().decode('utf-8', 'replace')}"); return False
+    return True
+
+def _frame_progress_callbacks(progress, task):
+    """返回回调工厂: 每个 ffmpeg 进程报告各自已输出的帧数，汇总后驱动同一个进度条"""
+    counts = {}
+    def make_callback(key):
+        def on_frames(frame_count):
+            counts[key] = frame_count
+            progress.update(task, completed=sum(counts.values()))
+        return on_frames
+    return make_callback
+
+# --- FFmpeg 原生模式 ---
+# 蒙版与画布都是静态的: 用 Pillow 渲染一次为 PNG，再交给 ffmpeg 滤镜图在解码时逐帧应用。
+NATIVE_TOLERANCE = 2 # 与 Pillow 路径对比时允许的最大单通道像素差
+
+def _canvas_offset(frame_size, comp_settings):
+    """计算帧在画布上的居中粘贴位置 (与 Pillow 路径的整除取整一致)"""
+    return (comp_settings['width'] - frame_size[0]) // 2, (comp_settings['height'] - frame_size[1]) // 2
+
+def _build_native_filtergraph(settings, work_folder):
+    """渲染静态蒙版 PNG 并构建 ffmpeg 滤镜图，返回 (额外输入参数, 滤镜图, 输出标签)"""
+    frame_size = _get_output_dims(settings['scaling'], settings['original_dims'])
+    pro_settings, comp_settings = settings['processing'], settings['composition']
+    extra_inputs, graph = [], []
+    chain = extraction_plan(settings)[1] # 先选帧再缩放，被丢弃的帧不必缩放
+    if _get_scale_filter(settings['scaling'], settings['original_dims']): chain.append(f"scale={frame_size[0]}:{frame_size[1]}")
+    if not pro_settings['enabled'] and not comp_settings['enabled']:
+        graph.append(f"[0:v]{','.join(chain)}[out]")
+        return extra_inputs, ";".join(graph), "[out]"
+    # 先转为 rgb24 再加 Alpha: swscale 缩放时 yuv→rgba 与 yuv→rgb24 的结果最多相差 4，参考帧 (及经典模式) 走的是 rgb24
+    graph.append(f"[0:v]{','.join(chain)},format=rgb24,format=rgba[v]")
+    label = "[v]"
+    if pro_settings['enabled']:
+        mask_path = os.path.join(work_folder, "native_mask.png")
+        get_effects_mask(frame_size, pro_settings).save(mask_path)
+        extra_inputs.extend(['-i', mask_path])
+        graph.append(f"[{len(extra_inputs) // 2}:v]format=gray[m];[v][m]alphamerge[fx]")
+        label = "[fx]"
+    if comp_settings['enabled']:
+        canvas_w, canvas_h = comp_settings['width'], comp_settings['height']
+        paste_x, paste_y = _canvas_offset(frame_size, comp_settings)
+        bg_alpha = floor(255 * (comp_settings['bg_opacity'] / 100))
+        bg_hex = "0x%02X%02X%02X" % hex_to_rgb(comp_settings['bg_color'])
+        crop_x, crop_y = max(-paste_x, 0), max(-paste_y, 0)
+        crop = f"crop={min(frame_size[0] - crop_x, canvas_w - max(paste_x, 0))}:{min(frame_size[1] - crop_y, canvas_h - max(paste_y, 0))}:{crop_x}:{crop_y},pad={canvas_w}:{canvas_h}:{max(paste_x, 0)}:{max(paste_y, 0)}"
+        if not pro_settings['enabled']:
+            # 与 compose_frame 一致: 不透明帧不混合，超出画布的部分裁掉后直接垫到画布上
+            graph.append(f"{label}{crop}:color={bg_hex}@0x{bg_alpha:02X}[out]")
+        else:
+            # 与 compose_frame 的蒙版粘贴一致: 颜色按帧 Alpha 叠加在不透明背景色上；Alpha 通道为 (背景 Alpha·(255-a) + a·a)/255，
+            # 用 lut 按 Pillow 的整数舍入逐像素计算 (画布上帧以外的区域 a 为 0，结果即背景 Alpha)
+            rate = Fraction(extraction_frame_rate(settings)) # 与选帧后的时间戳一致，overlay 才能逐帧对应
+            blend = f"({bg_alpha}*(255-val)+val*val+128)"
+            graph.append(f"{label}split[fc][fa]")
+            graph.append(f"color=c={bg_hex}:s={canvas_w}x{canvas_h}:r={rate.numerator}/{rate.denominator},format=rgb24[bg];[bg][fc]overlay=x={paste_x}:y={paste_y}:shortest=1:format=rgb,format=rgb24[rgb]")
+            graph.append(f"[fa]alphaextract,{crop}:color=black,lut=c0='trunc(({blend}+trunc({blend}/256))/256)'[a]")
+            graph.append("[rgb][a]alphamerge[out]")
+        label = "[out]"
+    return extra_inputs, ";".join(graph), label
+
+def _extract_native(settings, console, on_frames=None):
+    """FFmpeg 原生模式: 一条滤镜图完成缩放、蒙版与画布合成，成品帧直接写入输出目录"""
+    temp_folder = settings['paths']['temp_extraction_folder']
+    output_folder = settings['paths']['output']
+    os.makedirs(output_folder, exist_ok=True)
+    extra_inputs, filtergraph, out_label = _build_native_filtergraph(settings, temp_folder)
+    input_args, _, output_args = extraction_plan(settings)
+    # 逐帧 PNG 直接由 ffmpeg 编码；其他格式在校验后统一转码
+    encode_options = ['-compression_level', str(settings['output']['compress_level'])] if settings['output']['format'] in ('png', 'apng') else []
+    thread_input, thread_output = _thread_args(settings)
+    command = ['ffmpeg', *thread_input, *input_args, '-i', settings['paths']['input'], *extra_inputs, *_filter_args('-filter_complex', filtergraph), '-map', out_label, *output_args, *thread_output, *encode_options, '-start_number', '0', '-y', os.path.join(output_folder, FRAME_NAME_PATTERN)]
+    return _run_extract_command(command, console, on_frames)
+
+def verify_native_output(settings, console):
+    """取首帧分别走 Pillow 路径与 FFmpeg 原生路径，检查两者像素差是否在容差内"""
+    temp_folder = settings['paths']['temp_extraction_folder']
+    reference_path = os.path.join(temp_folder, "native_reference.png")
+    if not _run_extract_command(_extract_command(settings, ['-frames:v', '1', '-update', '1', '-y', reference_path]), console): return False
+    if settings['processing']['enabled']: _apply_effects_file(reference_path, settings['processing'])
+    reference = Image.open(reference_path)
+    if settings['composition']['enabled']: reference = compose_frame(reference, settings['composition'])
+    native = Image.open(os.path.join(settings['paths']['output'], frame_filename(0)))
+    if native.size != reference.size or native.mode != reference.mode:
+        console.print(f"[bold red]原生模式校验失败: 输出 {native.mode} {native.size} 与 Pillow 路径 {reference.mode} {reference.size} 不一致。[/bold red]"); return False
+    max_diff = max(high for _, high in ImageChops.difference(native, reference).getextrema())
+    if max_diff > NATIVE_TOLERANCE:
+        console.print(f"[bold red]原生模式校验失败: 与 Pillow 路径的最大像素差为 {max_diff} (容差 {NATIVE_TOLERANCE})。[/bold red]"); return False
+    console.print(f"[dim]原生模式校验通过: 与 Pillow 路径的最大像素差为 {max_diff}。[/dim]")
+    return True
+
+def module_1_extract(settings, console, manifest=None):
+    input_file = settings['paths']['input']
+    temp_folder = settings['paths']['temp_extraction_folder']
+    os.makedirs(temp_folder, exist_ok=True)
+    duration = probe_video(input_file).duration
+    total_frames = expected_frame_count(settings, duration)
+    progress_columns = (TextColumn("[progress.description]{task.description}"), BarColumn(), TextColumn("{task.completed} 帧"), TimeRemainingColumn())
+    if settings['execution']['mode'] == 'ffmpeg':
+        console.print("[yellow]步骤 1/1: FFmpeg 原生滤镜图一次完成提取、加工与合成...[/yellow]")
+        with Progress(*progress_columns, console=console) as progress:
+            task = progress.add_task("[green]FFmpeg 正在运行...", total=total_frames)
+            if not _extract_native(settings, console, _frame_progress_callbacks(progress, task)(0)): return False
+            output_folder = settings['paths']['output']
+            for f in os.listdir(output_folder):
+                if is_frame_file(f): record_bytes_written('output' if settings['output']['format'] == 'png' else 'intermediate', os.path.join(output_folder, f))
+        console.print("[green]成品帧输出成功！[/green]")
+        return True
+    start_frame = _resume_start_frame(settings, manifest)
+    if start_frame and total_frames is not None: total_frames = max(0, total_frames - start_frame)
+    segments = settings['extraction']['segments']
+    if segments > 1 and settings['extraction']['select'] != 'fps':
+        console.print("[dim]分段并行提取只适用于按帧率抽帧，本次改为单进程提取。[/dim]"); segments = 1
+    console.print("[yellow]步骤 1/3: 使用 ffmpeg 提取并缩放帧...[/yellow]")
+    with Progress(*progress_columns, console=console) as progress:
+        task = progress.add_task("[green]FFmpeg 正在运行..." if segments <= 1 else f"[green]{segments} 个 FFmpeg 进程正在分段运行...", total=total_frames)
+        make_callback = _frame_progress_callbacks(progress, task)
+        output_pattern = os.path.join(temp_folder, FRAME_NAME_PATTERN)
+        if segments > 1:
+            if not _extract_segmented(settings, output_pattern, segments, duration, console, make_callback, start_frame): return False
+        elif not _run_extract_command(_extract_command(settings, ['-start_number', str(start_frame), '-y', output_pattern], start_frame), console, make_callback(0)): return False
+        extracted = [f for f in os.listdir(temp_folder) if f.endswith('.png')]
+        for f in extracted: record_bytes_written('intermediate', os.path.join(temp_folder, f))
+        progress.update(task, total=len(extracted), completed=len(extracted))
     console.print("[green]帧提取成功！[/green]")
     return True
 
-def module_2_process(settings, console):
+# --- 结果缓存与断点续传 ---
+# 输出目录中保存一份清单: 以 "输入文件指纹 + 规范化后的处理参数" 为键，记录已写出的成品帧。
+# 键一致时，已完成的任务直接返回，中断的任务从第一个未完成的帧继续提取 (按帧率抽帧时)；键变化时清除旧清单记录的帧并重新开始。
+CACHE_MANIFEST_NAME = ".picopico_cache.json"
+_MANIFEST_FLUSH_INTERVAL = 2.0 # 秒
+_FINGERPRINT_BLOCK = 1 << 20
+
+def _file_fingerprint(path):
+    """输入文件指纹: 大小、修改时间与首/中/尾各一块内容的 SHA-256，不必读取整个视频"""
+    stat = os.stat(path)
+    digest = hashlib.sha256(f"{stat.st_size}:{stat.st_mtime_ns}".encode('utf-8'))
+    with open(path, 'rb') as f:
+        for offset in sorted({0, max(0, (stat.st_size - _FINGERPRINT_BLOCK) // 2), max(0, stat.st_size - _FINGERPRINT_BLOCK)}):
+            f.seek(offset); digest.update(f.read(_FINGERPRINT_BLOCK))
+    return digest.hexdigest()
+
+def _normalized_extraction(ext):
+    """帧选取参数中影响输出的部分；默认值不写入，旧版本的缓存键保持不变"""
+    normalized = {'fps': ext['fps']}
+    if ext.get('start'): normalized['start'] = ext['start']
+    if ext.get('end'): normalized['end'] = ext['end']
+    if ext.get('select', 'fps') != 'fps':
+        normalized['select'] = ext['select']
+        if ext['select'] == 'nth': normalized['every_nth'] = ext['every_nth']
+        elif ext['select'] == 'list': normalized['frames'] = ext['frames']
+    return normalized
+
+def _normalized_job_settings(settings):
+    """只保留影响输出内容的参数: 缩放取最终滤镜，关闭的模块只记录关闭状态，执行方式不参与"""
+    pro, com = settings['processing'], settings['composition']
+    return {
+        'original_dims': list(settings['original_dims']),
+        'extraction': _normalized_extraction(settings['extraction']),
+        'scaling': _get_scale_filter(settings['scaling'], settings['original_dims']),
+        'processing': pro if pro['enabled'] else {'enabled': False},
+        'composition': com if com['enabled'] else {'enabled': False},
+        'dedup': settings['dedup'] if settings['dedup']['enabled'] else {'enabled': False},
+        'output': settings['output'],
+        'atlas': settings['atlas'] if settings['atlas']['enabled'] else {'enabled': False},
+    }
+
+def load_output_manifest(settings):
+    """读取 (或新建) 输出目录中的缓存清单，键不一致时清除旧清单记录的帧"""
+    input_file = settings['paths']['input']
+    output_folder = settings['paths']['output']
+    manifest_path = os.path.join(output_folder, CACHE_MANIFEST_NAME)
+    stat = os.stat(input_file)
+    input_hash = _file_fingerprint(input_file)
+    previous = {}
+    if os.path.isfile(manifest_path):
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f: previous = json.load(f)
+        except (OSError, ValueError): previous = {}
+    normalized = _normalized_job_settings(settings)
+    key = hashlib.sha256((input_hash + json.dumps(normalized, sort_keys=True)).encode('utf-8')).hexdigest()
+    frames = []
+    if previous.get('key') == key:
+        frames = [f for f in previous.get('frames', []) if os.path.isfile(os.path.join(output_folder, f))]
+    else:
+        for f in previous.get('frames', []):
+            stale_path = os.path.join(output_folder, f)
+            if os.path.isfile(stale_path): os.remove(stale_path)
+    complete = previous.get('key') == key and previous.get('status') == 'complete' and len(frames) == len(previous.get('frames', []))
+    return {'path': manifest_path, 'key': key, 'input': {'path': os.path.abspath(input_file), 'size': stat.st_size, 'mtime': stat.st_mtime, 'fingerprint': input_hash},
+            'settings': normalized, 'status': 'complete' if complete else 'running', 'frames': frames, 'done': set(frames), 'saved_at': 0.0}
+
+def save_output_manifest(manifest, status=None):
+    """写出缓存清单 (先写临时文件再替换，避免中断时留下损坏的清单)"""
+    if status: manifest['status'] = status
+    os.makedirs(os.path.dirname(manifest['path']), exist_ok=True)
+    data = {k: manifest[k] for k in ('key', 'input', 'settings', 'status')}
+    data['frames'] = sorted(manifest['done'])
+    temp_path = manifest['path'] + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f: json.dump(data, f, ensure_ascii=False)
+    os.replace(temp_path, manifest['path'])
+    manifest['saved_at'] = time.time()
+
+def mark_frames_done(manifest, filenames):
+    """记录已写出的成品帧，并按时间间隔落盘"""
+    if manifest is None: return
+    manifest['done'].update(filenames)
+    if time.time() - manifest['saved_at'] >= _MANIFEST_FLUSH_INTERVAL: save_output_manifest(manifest)
+
+def _is_frame_done(manifest, filename):
+    return manifest is not None and filename in manifest['done']
+
+def _resume_start_frame(settings, manifest):
+    """断点续传时提取可以直接定位到的帧号 (第一个未完成的成品帧)
+    仅按帧率抽帧且未启用去重时可用: 其余选帧方式的帧号与时间不对应，去重需要从头比较每一帧，此时返回 0。"""
+    if manifest is None or not manifest['done'] or settings['extraction']['select'] != 'fps' or settings['dedup']['enabled']: return 0
+    frame = 0
+    while output_frame_name(frame_filename(frame), settings['output']) in manifest['done']: frame += 1
+    return frame
+
+# --- 重复帧检测 ---
+# 录屏素材常有大段静止画面: 每帧计算像素哈希 (可选与上一张唯一帧按阈值比较)，重复帧只处理一次，
+# 输出时再以硬链接、复制或索引文件的形式还原出完整、有序的帧序列。
+DEDUP_INDEX_NAME = "frames_index.json"
+DEDUP_OUTPUT_LABELS = {'link': '硬链接', 'copy': '复制文件', 'index': '仅索引文件'}
+
+def _new_dedup_state(dedup_settings):
+    return {'threshold': dedup_settings['threshold'], 'hashes': {}, 'last_image': None, 'last_name': None, 'mapping': {}}
+
+def match_duplicate_frame(state, filename, frame_img):
+    """返回该帧对应的唯一帧文件名；若为新的唯一帧则返回自身文件名"""
+    digest = hashlib.sha1(f"{frame_img.mode}{frame_img.size}".encode('ascii') + frame_img.tobytes()).hexdigest()
+    unique = state['hashes'].get(digest)
+    last_image = state['last_image']
+    if unique is None and state['threshold'] > 0 and last_image is not None and last_image.size == frame_img.size and last_image.mode == frame_img.mode:
+        # 阈值模式: 与上一张唯一帧比较 (而非上一帧)，避免静止画面中的噪点逐帧累积漂移
+        if max(high for _, high in ImageChops.difference(frame_img, last_image).getextrema()) <= state['threshold']: unique = state['last_name']
+    if unique is None:
+        unique = filename
+        state['hashes'][digest] = filename
+        if state['threshold'] > 0: state['last_image'], state['last_name'] = frame_img.copy(), filename
+    state['mapping'][filename] = unique
+    return unique
+
+def module_dedup(settings, folder, console):
+    """检测目录中的重复帧并删除，返回 {帧文件名: 唯一帧文件名} 映射"""
+    console.print("[yellow]检测重复帧...[/yellow]")
+    state = _new_dedup_state(settings['dedup'])
+    for filename in sorted(f for f in os.listdir(folder) if f.endswith('.png')):
+        image_path = os.path.join(folder, filename)
+        with Image.open(image_path) as frame_img:
+            unique = match_duplicate_frame(state, filename, frame_img)
+        if unique != filename: os.remove(image_path)
+    unique_count = len(set(state['mapping'].values()))
+    console.print(f"[green]共 {len(state['mapping'])} 帧，其中唯一帧 {unique_count} 帧。[/green]")
+    return state['mapping']
+
+def materialize_duplicates(settings, mapping, manifest=None):
+    """在输出目录中还原重复帧 (硬链接/复制)，并写出帧号到唯一图片的索引文件"""
+    output_folder = settings['paths']['output']
+    output_mode = settings['dedup']['output']
+    mapping = {output_frame_name(f, settings['output']): output_frame_name(unique, settings['output']) for f, unique in mapping.items()}
+    for filename, unique in mapping.items():
+        if unique == filename or output_mode == 'index': continue
+        target_path = os.path.join(output_folder, filename)
+        if os.path.lexists(target_path): os.remove(target_path)
+        source_path = os.path.join(output_folder, unique)
+        if output_mode == 'link':
+            try: os.link(source_path, target_path)
+            except OSError: shutil.copyfile(source_path, target_path) # 文件系统不支持硬链接时退回复制
+        else: shutil.copyfile(source_path, target_path)
+        mark_frames_done(manifest, [filename])
+    index = {'frame_count': len(mapping), 'unique_count': len(set(mapping.values())), 'frames': [{'frame': f, 'image': mapping[f]} for f in sorted(mapping)]}
+    with open(os.path.join(output_folder, DEDUP_INDEX_NAME), 'w', encoding='utf-8') as f: json.dump(index, f, ensure_ascii=False, indent=1)
+
+# --- 多进程帧处理 ---
+# 进程池任务必须是模块级函数 (可被 pickle)，且不能持有 console，错误以字符串形式返回给主进程打印。
+
+def _effects_batch_task(image_paths, processing_settings, encoder):
+    """进程池任务: 依次加工一批图片，遇到首个错误即停止，返回 (完成数量, 错误信息, 指标)"""
+    reset_metrics()
+    for done, image_path in enumerate(image_paths):
+        try: _apply_effects_file(image_path, processing_settings, encoder)
+        except Exception as e: return done, f"图片效果应用失败 ({os.path.basename(image_path)}): {e}", metrics_snapshot()
+    return len(image_paths), None, metrics_snapshot()
+
+def _compose_batch_task(file_pairs, comp_settings, encoder):
+    """进程池任务: 依次合成一批图片，遇到首个错误即停止，返回 (完成数量, 错误信息, 指标)"""
+    reset_metrics()
+    for done, (image_path, output_path) in enumerate(file_pairs):
+        try: _compose_file(image_path, output_path, comp_settings, encoder)
+        except Exception as e: return done, f"合成图片时发生错误({os.path.basename(image_path)}): {e}", metrics_snapshot()
+    return len(file_pairs), None, metrics_snapshot()
+
+def _run_parallel_batches(task_fn, items, task_args, workers, progress, task, on_done=None):
+    """将有序帧列表切分为小批次分发到进程池，按完成量推进进度条；首个失败后取消剩余批次并返回错误信息
+    on_done 会收到每个批次中已完成的条目，用于记录进度。"""
+    batch_size = max(1, min(16, len(items) // (workers * 4)))
+    batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(task_fn, batch, *task_args): batch for batch in batches}
+        for future in as_completed(futures):
+            done, error, snapshot = future.result()
+            merge_metrics(snapshot)
+            progress.update(task, advance=done)
+            if on_done: on_done(futures[future][:done])
+            if error:
+                for pending in futures: pending.cancel()
+                return error
+    return None
+
+def module_2_process(settings, console, manifest=None, encoder=None):
     if not settings['processing']['enabled']:
         console.print("[dim]步骤 2/3: 图片加工已跳过。[/dim]"); return True
     console.print("[yellow]步骤 2/3: 加工图片效果...[/yellow]")
     temp_folder = settings['paths']['temp_extraction_folder']
-    image_files = sorted([f for f in os.listdir(temp_folder) if f.endswith('.png')])
+    # 不做画布合成时，加工结果即为成品，直接按输出格式编码；否则写出快速 PNG 中间帧
+    if settings['composition']['enabled']: encoder = INTERMEDIATE_ENCODER
+    else: encoder = encoder or build_output_encoder(settings)
+    image_files = sorted([f for f in os.listdir(temp_folder) if f.endswith('.png') and not _is_frame_done(manifest, output_frame_name(f, settings['output']))])
     with Progress(TextColumn("[progress.description]{task.description}"), BarColumn(), TextColumn("[progress.percentage]{task.percentage:>3.0f}%"), TimeRemainingColumn(), console=console) as progress:
         task = progress.add_task("[green]加工中...", total=len(image_files))
+        workers = settings['execution']['workers']
+        if workers > 1:
+            image_paths = [os.path.join(temp_folder, f) for f in image_files]
+            error = _run_parallel_batches(_effects_batch_task, image_paths, (settings['processing'], encoder), workers, progress, task)
+            if error: console.print(f"\n[red]{error}[/red]"); return False
+            image_files = []
         for filename in image_files:
             image_path = os.path.join(temp_folder, filename)
-            if not apply_effects_to_image(image_path, settings['processing'], console): return False
+            if not apply_effects_to_image(image_path, settings['processing'], console, encoder): return False
             progress.update(task, advance=1)
     console.print("[green]图片加工完成！[/green]")
     return True
 
-def module_3_compose(settings, console):
+# --- 画布合成引擎 ---
+# 一次任务中画布尺寸、背景与粘贴位置都不变: 背景模板与粘贴位置只计算一次，逐帧只做一次复制与混合。
+_CANVAS_CACHE = {}
+_CANVAS_CACHE_LIMIT = 16
+
+def get_canvas_template(frame_size, comp_settings):
+    """按 (帧尺寸, 画布尺寸, 背景色, 透明度) 缓存背景模板，返回 (模板, 粘贴位置)"""
+    key = (frame_size, comp_settings['width'], comp_settings['height'], comp_settings['bg_color'], comp_settings['bg_opacity'])
+    template = _CANVAS_CACHE.get(key)
+    if template is None:
+        if len(_CANVAS_CACHE) >= _CANVAS_CACHE_LIMIT: _CANVAS_CACHE.pop(next(iter(_CANVAS_CACHE)))
+        bg_alpha = floor(255 * (comp_settings['bg_opacity'] / 100))
+        canvas = Image.new('RGBA', (comp_settings['width'], comp_settings['height']), (*hex_to_rgb(comp_settings['bg_color']), bg_alpha))
+        template = _CANVAS_CACHE[key] = (canvas, _canvas_offset(frame_size, comp_settings))
+    return template
+
+def compose_frame(frame_img, comp_settings):
+    """将单帧居中合成到画布上，返回新画布
+    带 Alpha 的帧以自身为蒙版粘贴 (与最初的逐帧实现一致: 颜色与 Alpha 通道都按帧的 Alpha 在背景与帧之间插值)；
+    不透明帧 (RGB) 直接粘贴，铺满画布时跳过画布复制。"""
+    canvas_template, (paste_x, paste_y) = get_canvas_template(frame_img.size, comp_settings)
+    opaque_frame = frame_img.mode == 'RGB'
+    covers_canvas = paste_x <= 0 and paste_y <= 0 and paste_x + frame_img.width >= canvas_template.width and paste_y + frame_img.height >= canvas_template.height
+    if covers_canvas and opaque_frame:
+        # 快速路径: 不透明帧铺满画布，背景不可见
+        frame_img = frame_img.convert('RGBA')
+        if frame_img.size == canvas_template.size: return frame_img
+        return frame_img.crop((-paste_x, -paste_y, -paste_x + canvas_template.width, -paste_y + canvas_template.height))
+    canvas = canvas_template.copy()
+    canvas.paste(frame_img, (paste_x, paste_y), None if opaque_frame else frame_img)
+    return canvas
+
+def _compose_file(image_path, output_path, comp_settings, encoder):
+    """读取单帧、合成到画布并写出成品，失败时抛出异常"""
+    with stage_timer('decode'):
+        frame_img = Image.open(image_path)
+        frame_img.load()
+    with stage_timer('composite'): canvas = compose_frame(frame_img, comp_settings)
+    encode_frame(canvas, output_path, encoder)
+
+def module_3_compose(settings, console, manifest=None, encoder=None):
+    output_settings = settings['output']
     if not settings['composition']['enabled']:
         console.print("[dim]步骤 3/3: 画布合成已跳过。[/dim]")
         output_folder = settings['paths']['output']
         temp_folder = settings['paths']['temp_extraction_folder']
+        # 加工过的帧已按输出格式编码；未加工的 ffmpeg 原始帧只有在输出格式不同时才需要转码
+        passthrough = settings['processing']['enabled'] or (output_settings['format'] in ('png', 'apng') and output_settings['compress_level'] == DEFAULT_COMPRESS_LEVEL)
         if temp_folder != output_folder:
              os.makedirs(output_folder, exist_ok=True)
-             for f in os.listdir(temp_folder): shutil.move(os.path.join(temp_folder, f), os.path.join(output_folder, f))
+             if not passthrough: encoder = encoder or build_output_encoder(settings)
+             for f in sorted(os.listdir(temp_folder)):
+                 output_name = output_frame_name(f, output_settings)
+                 if _is_frame_done(manifest, output_name): continue
+                 if passthrough: shutil.move(os.path.join(temp_folder, f), os.path.join(output_folder, output_name))
+                 else: _reencode_file(os.path.join(temp_folder, f), os.path.join(output_folder, output_name), encoder)
+                 mark_frames_done(manifest, [output_name])
         return True
     console.print("[yellow]步骤 3/3: 进行画布合成...[/yellow]")
     temp_folder = settings['paths']['temp_extraction_folder']
     output_folder = settings['paths']['output']
     os.makedirs(output_folder, exist_ok=True)
-    image_files = sorted([f for f in os.listdir(temp_folder) if f.endswith('.png')])
+    image_files = sorted([f for f in os.listdir(temp_folder) if f.endswith('.png') and not _is_frame_done(manifest, output_frame_name(f, output_settings))])
     comp_settings = settings['composition']
-    canvas_w, canvas_h = comp_settings['width'], comp_settings['height']
-    bg_color_rgb = hex_to_rgb(comp_settings['bg_color'])
-    bg_alpha = floor(255 * (comp_settings['bg_opacity'] / 100))
-    bg_color_rgba = (*bg_color_rgb, bg_alpha)
+    encoder = encoder or build_output_encoder(settings)
     with Progress(TextColumn("[progress.description]{task.description}"), BarColumn(), TextColumn("[progress.percentage]{task.percentage:>3.0f}%"), TimeRemainingColumn(), console=console) as progress:
         task = progress.add_task("[green]合成中...", total=len(image_files))
+        workers = settings['execution']['workers']
+        if workers > 1:
+            file_pairs = [(os.path.join(temp_folder, f), os.path.join(output_folder, output_frame_name(f, output_settings))) for f in image_files]
+            error = _run_parallel_batches(_compose_batch_task, file_pairs, (comp_settings, encoder), workers, progress, task, on_done=lambda pairs: mark_frames_done(manifest, [os.path.basename(o) for _, o in pairs]))
+            if error: console.print(f"\n[bold red]{error}[/bold red]"); return False
+            image_files = []
         for filename in image_files:
             try:
-                image_path = os.path.join(temp_folder, filename)
-                frame_img = Image.open(image_path)
-                canvas = Image.new('RGBA', (canvas_w, canvas_h), bg_color_rgba)
-                paste_x = (canvas_w - frame_img.width) // 2
-                paste_y = (canvas_h - frame_img.height) // 2
-                canvas.paste(frame_img, (paste_x, paste_y), frame_img)
-                output_path = os.path.join(output_folder, filename)
-                canvas.save(output_path)
+                output_name = output_frame_name(filename, output_settings)
+                _compose_file(os.path.join(temp_folder, filename), os.path.join(output_folder, output_name), comp_settings, encoder)
+                mark_frames_done(manifest, [output_name])
                 progress.update(task, advance=1)
             except Exception as e:
                 console.print(f"\n[bold red]合成图片时发生错误({filename}):[/bold red] {e}"); return False
     console.print("[green]画布合成完成！[/green]")
     return True
 
-def generate_preview(settings):
+def _iter_raw_frames(command, frame_size, stderr_file):
+    """启动 ffmpeg 并从管道中逐帧读取原始 RGBA 数据"""
+    frame_bytes = frame_size[0] * frame_size[1] * 4
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr_file)
+    try:
+        while True:
+            with stage_timer('decode'):
+                data = process.stdout.read(frame_bytes)
+                if len(data) < frame_bytes: break
+                frame_img = Image.frombytes("RGBA", frame_size, data)
+            yield frame_img
+    finally:
+        process.stdout.close()
+        if process.poll() is None: process.terminate()
+        process.wait()
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
+
+def reencode_output_frames(settings, console):
+    """FFmpeg 原生模式: 校验通过后把输出目录中的 PNG 帧转码为所选的输出格式"""
+    output_folder = settings['paths']['output']
+    encoder = build_output_encoder(settings)
+    frame_files = sorted(f for f in os.listdir(output_folder) if is_frame_file(f) and f.endswith('.png'))
+    with Progress(TextColumn("[progress.description]{task.description}"), BarColumn(), TextColumn("[progress.percentage]{task.percentage:>3.0f}%"), TimeRemainingColumn(), console=console) as progress:
+        task = progress.add_task(f"[green]转码为 {OUTPUT_FORMAT_LABELS[encoder['format']]}...", total=len(frame_files))
+        for f in frame_files:
+            _reencode_file(os.path.join(output_folder, f), os.path.join(output_folder, output_frame_name(f, settings['output'])), encoder)
+            progress.update(task, advance=1)
+
+def _raw_pipe_command(settings, start_frame=0):
+    """返回 (ffmpeg 命令, 帧尺寸, 预计帧数)：按缩放与帧选取参数把原始 RGBA 帧输出到管道，从 start_frame 开始"""
+    frame_size = _get_output_dims(settings['scaling'], settings['original_dims'])
+    # 与经典模式的 PNG 提取走同一条色彩转换路径 (rgb24)，缩放时 yuv→rgba 最多相差 4
+    command = _extract_command(settings, ['-f', 'rawvideo', '-pix_fmt', 'rgba', 'pipe:1'], start_frame, tail_filters=["format=rgb24"])
+    command = [command[0], '-v', 'error', *command[1:]]
+    total = expected_frame_count(settings, probe_video(settings['paths']['input']).duration)
+    return command, frame_size, None if total is None else max(0, total - start_frame)
+
+def _render_raw_frame(frame_img, pro_settings, comp_settings):
+    """对管道读出的原始 RGBA 帧应用蒙版并合成，返回成品图像"""
+    with stage_timer('mask'):
+        if pro_settings['enabled']: frame_img.putalpha(get_effects_mask(frame_img.size, pro_settings))
+        else: frame_img = frame_img.convert("RGB") # 视频帧本身不透明，与经典模式的输出保持一致
+    if comp_settings['enabled']:
+        with stage_timer('composite'): frame_img = compose_frame(frame_img, comp_settings)
+    return frame_img
+
+def module_stream(settings, console, manifest=None):
+    """流式模式: ffmpeg 通过管道输出原始 RGBA 帧，在内存中完成加工与合成，每帧只编码一次 PNG"""
+    output_folder = settings['paths']['output']
+    os.makedirs(output_folder, exist_ok=True)
+    start_frame = _resume_start_frame(settings, manifest)
+    command, frame_size, total = _raw_pipe_command(settings, start_frame)
+    pro_settings, comp_settings = settings['processing'], settings['composition']
+    dedup_state = _new_dedup_state(settings['dedup']) if settings['dedup']['enabled'] else None
+    console.print("[yellow]流式处理: 提取、加工与合成同步进行...[/yellow]")
+    encoder = build_output_encoder(settings)
+    with tempfile.TemporaryFile() as stderr_file:
+        try:
+            with Progress(TextColumn("[progress.description]{task.description}"), BarColumn(), TextColumn("[progress.percentage]{task.percentage:>3.0f}%"), TimeRemainingColumn(), console=console) as progress:
+                task = progress.add_task("[green]处理中...", total=total)
+                frame_count = start_frame
+                for frame_img in _iter_raw_frames(command, frame_size, stderr_file):
+                    filename = frame_filename(frame_count)
+                    output_name = output_frame_name(filename, settings['output'])
+                    is_duplicate = dedup_state is not None and match_duplicate_frame(dedup_state, filename, frame_img) != filename
+                    if not is_duplicate and not _is_frame_done(manifest, output_name):
+                        try: encode_frame(_render_raw_frame(frame_img, pro_settings, comp_settings), os.path.join(output_folder, output_name), encoder)
+                        except Exception as e:
+                            console.print(f"\n[bold red]处理帧时发生错误({filename}):[/bold red] {e}"); return False
+                        mark_frames_done(manifest, [output_name])
+                    frame_count += 1
+                    progress.update(task, advance=1)
+                progress.update(task, total=frame_count - start_frame, completed=frame_count - start_frame)
+            if dedup_state is not None:
+                materialize_duplicates(settings, dedup_state['mapping'], manifest)
+                console.print(f"[green]共 {frame_count} 帧，其中唯一帧 {len(dedup_state['hashes'])} 帧。[/green]")
+        except subprocess.CalledProcessError:
+            stderr_file.seek(0)
+            console.print(f"\n[bold red]ffmpeg 提取失败！[/bold red]\n{stderr_file.read().decode('utf-8', 'replace')}"); return False
+    console.print("[green]流式处理完成！[/green]")
+    return True
+
+def _bounded_frame_task(data, frame_size, output_path, pro_settings, comp_settings, encoder):
+    """进程池任务: 加工、合成并编码一帧原始 RGBA 数据，返回 (错误信息, 指标)"""
+    reset_metrics()
+    try: encode_frame(_render_raw_frame(Image.frombytes("RGBA", frame_size, data), pro_settings, comp_settings), output_path, encoder)
+    except Exception as e: return f"处理帧时发生错误({os.path.basename(output_path)}): {e}", metrics_snapshot()
+    return None, metrics_snapshot()
+
+def module_bounded(settings, console, manifest=None):
+    """有界流水线模式: ffmpeg 管道解码，进程池并行加工、合成与编码，同时在途的帧数不超过上限
+    达到上限时主进程暂停读取管道，ffmpeg 随之阻塞 (背压)，内存占用与视频长度无关，也不产生临时帧文件。"""
+    output_folder = settings['paths']['output']
+    os.makedirs(output_folder, exist_ok=True)
+    start_frame = _resume_start_frame(settings, manifest)
+    command, frame_size, total = _raw_pipe_command(settings, start_frame)
+    pro_settings, comp_settings = settings['processing'], settings['composition']
+    workers, limit = settings['execution']['workers'], max(1, settings['execution']['max_in_flight'])
+    dedup_state = _new_dedup_state(settings['dedup']) if settings['dedup']['enabled'] else None
+    console.print(f"[yellow]有界流水线: {workers} 个进程并行处理，最多 {limit} 帧在途...[/yellow]")
+    encoder = build_output_encoder(settings)
+    pending, errors = {}, []
+    def collect(return_when):
+        done, _ = wait(pending, return_when=return_when)
+        for future in done:
+            error, snapshot = future.result()
+            merge_metrics(snapshot)
+            output_name = pending.pop(future)
+            if error: errors.append(error)
+            else: mark_frames_done(manifest, [output_name])
+            progress.update(task, advance=1)
+    with tempfile.TemporaryFile() as stderr_file, ProcessPoolExecutor(max_workers=workers) as executor:
+        try:
+            with Progress(TextColumn("[progress.description]{task.description}"), BarColumn(), TextColumn("[progress.percentage]{task.percentage:>3.0f}%"), TimeRemainingColumn(), console=console) as progress:
+                task = progress.add_task("[green]处理中...", total=total)
+                frame_count = start_frame
+                for frame_img in _iter_raw_frames(command, frame_size, stderr_file):
+                    filename = frame_filename(frame_count)
+                    output_name = output_frame_name(filename, settings['output'])
+                    is_duplicate = dedup_state is not None and match_duplicate_frame(dedup_state, filename, frame_img) != filename
+                    frame_count += 1
+                    if is_duplicate or _is_frame_done(manifest, output_name):
+                        progress.update(task, advance=1); continue
+                    while len(pending) >= limit and not errors: collect(FIRST_COMPLETED)
+                    if errors: break
+                    pending[executor.submit(_bounded_frame_task, frame_img.tobytes(), frame_size, os.path.join(output_folder, output_name), pro_settings, comp_settings, encoder)] = output_name
+                if pending: collect(ALL_COMPLETED)
+                if errors:
+                    console.print(f"\n[bold red]{errors[0]}[/bold red]"); return False
+                progress.update(task, total=frame_count - start_frame, completed=frame_count - start_frame)
+            if dedup_state is not None:
+                materialize_duplicates(settings, dedup_state['mapping'], manifest)
+                console.print(f"[green]共 {frame_count} 帧，其中唯一帧 {len(dedup_state['hashes'])} 帧。[/green]")
+        except subprocess.CalledProcessError:
+            stderr_file.seek(0)
+            console.print(f"\n[bold red]ffmpeg 提取失败！[/bold red]\n{stderr_file.read().decode('utf-8', 'replace')}"); return False
+    console.print("[green]有界流水线处理完成！[/green]")
+    return True
+
+# --- 资源预检 ---
+# 开始处理前，按探测到的时长、帧率与输出尺寸估算临时帧、成品与峰值内存。单帧大小取自按当前参数实际渲染并编码的样本帧，
+# 磁盘空间不足时在开始前就中止，而不是处理到一半才失败。
+PREFLIGHT_SAMPLE_FRAMES = 2
+PREFLIGHT_DISK_MARGIN = 1.1 # 估算之外再预留 10%
+
+def _existing_parent(path):
+    """返回 path 自身或最近的已存在上级目录 (用于查询所在磁盘的剩余空间)"""
+    path = os.path.abspath(path)
+    while not os.path.exists(path) and os.path.dirname(path) != path: path = os.path.dirname(path)
+    return path
+
+def _available_memory():
+    """可用物理内存 (字节)，无法获取时返回 None"""
+    try: return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError): return None
+
+def _format_bytes(count):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if count < 1024 or unit == 'GB': return f"{count:.0f} {unit}" if unit == 'B' else f"{count:.1f} {unit}"
+        count /= 1024
+
+def _encoded_size(frames, encoder):
+    """按编码器在内存中编码样本帧，返回平均单帧字节数"""
+    sizes = []
+    for frame_img in frames:
+        buffer = io.BytesIO()
+        _save_encoded(frame_img, buffer, encoder)
+        sizes.append(buffer.tell())
+    return sum(sizes) / len(sizes)
+
+def estimate_job_resources(settings):
+    """估算本次任务的帧数、临时帧与成品的磁盘占用、峰值内存，以及相关磁盘的剩余空间"""
+    metadata = probe_video(settings['paths']['input'])
+    exe = settings['execution']
+    mode = exe['mode']
+    frame_count = expected_frame_count(settings, metadata.duration)
+    if frame_count is None: raise RuntimeError("仅关键帧模式或视频时长未知时无法预先确定帧数")
+    frame_size = _get_output_dims(settings['scaling'], settings['original_dims'])
+    # 样本帧不写入预览缓存，避免批处理进程中长期占用内存
+    timestamps = window_timestamps(settings, metadata.duration or 0, PREFLIGHT_SAMPLE_FRAMES)
+    decoded = decode_preview_frames(settings, timestamps, cache=False)
+    samples, _ = render_preview_frames(settings, timestamps, cache=False, decoded=decoded)
+    output_format = settings['output']['format']
+    output_encoder = {'format': output_format, 'compress_level': settings['output']['compress_level'], 'palette': build_shared_palette(samples) if output_format == 'palette' else None}
+    raw_png = {'format': 'png', 'compress_level': DEFAULT_COMPRESS_LEVEL}
+    intermediate_frame = output_frame = _encoded_size(samples, output_encoder)
+    if mode == 'classic':
+        # 临时帧: ffmpeg 写出的 RGB PNG，加工后以快速压缩的 RGBA PNG 覆盖，取两者中较大者
+        sources = [frame_img for _, frame_img in decoded]
+        intermediate_frame = _encoded_size([img.convert('RGB') for img in sources], raw_png)
+        if settings['processing']['enabled']: intermediate_frame = max(intermediate_frame, _encoded_size(sources, INTERMEDIATE_ENCODER))
+    else: intermediate_frame = 0
+    if mode == 'ffmpeg' and output_format not in ('png', 'apng'): output_frame = max(output_frame, _encoded_size(samples, raw_png)) # 先写出 PNG 再转码
+    frame_bytes = max(frame_size[0] * frame_size[1], samples[0].width * samples[0].height) * 4
+    frames_in_memory = {'classic': 3 * exe['workers'], 'stream': 3, 'bounded': 2 * max(1, exe['max_in_flight']) + 3 * exe['workers'], 'ffmpeg': 4}[mode]
+    temp_root, output_root = _existing_parent(settings['paths']['temp_extraction_folder']), _existing_parent(settings['paths']['output'])
+    return {'frames': frame_count, 'frame_size': list(frame_size), 'output_size': list(samples[0].size),
+            'intermediate_bytes': int(intermediate_frame * frame_count), 'output_bytes': int(output_frame * frame_count), 'peak_memory_bytes': frame_bytes * frames_in_memory,
+            'temp_free_bytes': shutil.disk_usage(temp_root).free, 'output_free_bytes': shutil.disk_usage(output_root).free,
+            'same_device': os.stat(temp_root).st_dev == os.stat(output_root).st_dev, 'available_memory_bytes': _available_memory()}
+
+def preflight_check(settings, console):
+    """打印资源估算；磁盘空间不足时返回 False，内存可能不足时只给出提示"""
+    try: estimate = estimate_job_resources(settings)
+    except Exception as e:
+        console.print(f"[dim]资源预检已跳过: {e}[/dim]"); return True
+    _metrics()['preflight'] = estimate
+    console.print(f"[dim]资源预检: 约 {estimate['frames']} 帧，临时帧 {_format_bytes(estimate['intermediate_bytes'])}，成品 {_format_bytes(estimate['output_bytes'])}，峰值内存约 {_format_bytes(estimate['peak_memory_bytes'])}[/dim]")
+    if estimate['same_device']: needs = [(estimate['intermediate_bytes'] + estimate['output_bytes'], estimate['output_free_bytes'], "输出目录")]
+    else: needs = [(estimate['intermediate_bytes'], estimate['temp_free_bytes'], "临时目录"), (estimate['output_bytes'], estimate['output_free_bytes'], "输出目录")]
+    ok = True
+    for needed, free, label in needs:
+        if needed * PREFLIGHT_DISK_MARGIN > free:
+            console.print(f"[bold red]{label}所在磁盘空间不足: 预计需要 {_format_bytes(needed)}，剩余 {_format_bytes(free)}。[/bold red]"); ok = False
+    if not ok: console.print("[yellow]可改用流式或有界流水线模式 (不产生临时帧)、把临时目录设到其他磁盘，或关闭资源预检后强制运行。[/yellow]")
+    available = estimate['available_memory_bytes']
+    if available is not None and estimate['peak_memory_bytes'] > available:
+        console.print(f"[yellow]提示: 预计峰值内存 {_format_bytes(estimate['peak_memory_bytes'])} 超过当前可用内存 {_format_bytes(available)}，建议减少并行进程数或在途帧数。[/yellow]")
+    return ok
+
+def _run_pipeline_steps(settings, console):
+    """按执行模式运行各步骤，返回是否成功
+    启用结果缓存时: 输入与参数均未变化且上次已完成则直接返回，中断过的任务只补做未完成的帧。"""
+    error = selection_error(settings)
+    if error:
+        console.print(f"[bold red]{error}[/bold red]"); return False
+    manifest = None
+    if settings['execution']['resume']:
+        manifest = load_output_manifest(settings)
+        if manifest['status'] == 'complete':
+            console.print(f"[green]输入与参数均未变化，沿用已有的 {len(manifest['done'])} 帧输出。[/green]"); return True
+        if manifest['done'] and settings['execution']['mode'] != 'ffmpeg':
+            start_frame = _resume_start_frame(settings, manifest)
+            console.print(f"[cyan]检测到未完成的任务，已完成的 {len(manifest['done'])} 帧将被跳过{f'，从第 {start_frame} 帧继续提取' if start_frame else ''}。[/cyan]")
+        save_output_manifest(manifest, 'running')
+    if settings['execution']['preflight']:
+        with step_timer('preflight'):
+            if not preflight_check(settings, console): return False
+    temp_folder = settings['paths']['temp_extraction_folder']
+    success = False
+    try:
+        if settings['execution']['mode'] == 'stream':
+            with step_timer('stream'): success = module_stream(settings, console, manifest)
+        elif settings['execution']['mode'] == 'bounded':
+            with step_timer('bounded'): success = module_bounded(settings, console, manifest)
+        else:
+            if os.path.exists(temp_folder): shutil.rmtree(temp_folder)
+            dedup_enabled = settings['dedup']['enabled']
+            if settings['execution']['mode'] == 'ffmpeg':
+                # 原生模式没有逐帧处理环节，只能在输出后去重以节省存储
+                with step_timer('extract'): success = module_1_extract(settings, console)
+                with step_timer('verify'): success = success and verify_native_output(settings, console)
+                with step_timer('dedup'): mapping = module_dedup(settings, settings['paths']['output'], console) if success and dedup_enabled else None
+                if success and settings['output']['format'] in ('palette', 'webp', 'awebp'):
+                    with step_timer('encode'): reencode_output_frames(settings, console)
+                if success and mapping: materialize_duplicates(settings, mapping)
+                if success and manifest is not None: mark_frames_done(manifest, [f for f in os.listdir(settings['paths']['output']) if is_frame_file(f)])
+            else:
+                with step_timer('extract'): success = module_1_extract(settings, console, manifest)
+                with step_timer('dedup'): mapping = module_dedup(settings, temp_folder, console) if success and dedup_enabled else None
+                with step_timer('process'): success = success and module_2_process(settings, console, manifest)
+                with step_timer('compose'): success = success and module_3_compose(settings, console, manifest)
+                if success and mapping: materialize_duplicates(settings, mapping, manifest)
+        if success and settings['atlas']['enabled']:
+            with step_timer('atlas'): success = build_atlas(settings, console, manifest)
+        elif success and settings['output']['format'] in ANIMATION_FILENAMES:
+            with step_timer('animation'): success = assemble_animation(settings, console, manifest)
+    finally:
+        if os.path.exists(temp_folder): shutil.rmtree(temp_folder)
+        if manifest is not None: save_output_manifest(manifest, 'complete' if success else 'running')
+    return success
+
+def run_pipeline(settings, console):
+    """运行完整流程并返回是否成功；按需写出运行报告，或用 cProfile 剖析本次运行"""
+    reset_metrics()
+    started = time.perf_counter()
+    profiler = cProfile.Profile() if settings['execution']['profile'] else None
+    success = False
+    try:
+        if profiler: profiler.enable()
+        success = _run_pipeline_steps(settings, console)
+    finally:
+        if profiler:
+            profiler.disable()
+            os.makedirs(settings['paths']['output'], exist_ok=True)
+            profile_path = os.path.join(settings['paths']['output'], PROFILE_OUTPUT_NAME)
+            profiler.dump_stats(profile_path)
+            stats_text = io.StringIO()
+            pstats.Stats(profiler, stream=stats_text).sort_stats('cumulative').print_stats(15)
+            console.print(stats_text.getvalue().strip(), markup=False, highlight=False)
+            console.print(f"[cyan]性能剖析数据已保存: {profile_path}[/cyan]")
+        if settings['execution']['report']:
+            report_path = write_run_report(settings, time.perf_counter() - started, success)
+            console.print(f"[dim]运行报告已保存: {report_path}[/dim]")
+    return success
+
+# --- 即时预览 ---
+# 预览结果按阶段缓存在内存中: 源帧按 (视频, 缩放尺寸, 时间点) 只解码一次，加工与合成的结果按各自的参数缓存，
+# 修改圆角或背景色等参数后只重算受影响的阶段 (蒙版与画布模板另有缓存)。多个时间点在一次 ffmpeg 调用中同时解码。
+PREVIEW_SHEET_FRAMES = 6 # 联系表默认帧数
+PREVIEW_SHEET_MAX_FRAMES = 16
+PREVIEW_SHEET_MAX_WIDTH = 2400 # 联系表过宽时等比缩小各格
+PREVIEW_SHEET_GAP = 8
+_PREVIEW_CACHE_MAX_BYTES = 256 * 1024 * 1024 # 三个阶段合计的像素数据上限 (750x1624 的 RGBA 帧约 4.6 MB)
+_PREVIEW_CACHE = {'decoded': {}, 'processed': {}, 'composed': {}}
+_PREVIEW_CACHE_SIZES = {} # (阶段, 键) -> 字节数，按写入顺序排列，超出上限时从最早写入的开始淘汰
+
+def _preview_cache_put(stage, key, value):
+    size = value.width * value.height * len(value.getbands())
+    if size > _PREVIEW_CACHE_MAX_BYTES: return value
+    _PREVIEW_CACHE_SIZES.pop((stage, key), None)
+    total = sum(_PREVIEW_CACHE_SIZES.values())
+    while total + size > _PREVIEW_CACHE_MAX_BYTES:
+        (old_stage, old_key), old_size = next(iter(_PREVIEW_CACHE_SIZES.items()))
+        del _PREVIEW_CACHE_SIZES[(old_stage, old_key)], _PREVIEW_CACHE[old_stage][old_key]
+        total -= old_size
+    _PREVIEW_CACHE[stage][key] = value
+    _PREVIEW_CACHE_SIZES[(stage, key)] = size
+    return value
+
+def preview_timestamps(duration, count):
+    """在视频中均匀选取 count 个时间点 (各区间的中点)，count 为 1 时即视频正中间"""
+    return [round(duration * (i + 0.5) / count, 3) for i in range(count)]
+
+def decode_preview_frames(settings, timestamps, timings=None, cache=True):
+    """返回各时间点已缩放的源帧 [(缓存键, RGBA 图像)]；未缓存的时间点在一次 ffmpeg 调用中同时解码，耗时记入 timings['decode']
+    cache 为 False 时新解码的帧不写入缓存。"""
+    input_file = settings['paths']['input']
+    frame_size = _get_output_dims(settings['scaling'], settings['original_dims'])
+    # 与提取路径一样先转为 rgb24: 缩放时 yuv→rgba 与 yuv→rgb24 最多相差 4，预览应与实际输出一致
+    scale = f"scale={frame_size[0]}:{frame_size[1]},format=rgb24," if _get_scale_filter(settings['scaling'], settings['original_dims']) else "format=rgb24,"
+    base_key = (_video_identity(input_file), frame_size)
+    # 先取出已缓存的帧: 写入新帧时可能淘汰旧帧，结果不能再从缓存中读取
+    found = {t: _PREVIEW_CACHE['decoded'][(base_key, t)] for t in dict.fromkeys(timestamps) if (base_key, t) in _PREVIEW_CACHE['decoded']}
+    missing = [t for t in dict.fromkeys(timestamps) if t not in found]
+    if missing:
+        started = time.perf_counter()
+        # 每个时间点作为一个独立输入在输入端快速定位，只取一帧后按顺序拼接输出
+        command, thread_input = ['ffmpeg', '-v', 'error'], _thread_args(settings)[0]
+        for t in missing: command.extend([*thread_input, '-ss', str(t), '-i', input_file])
+        graph = [f"[{i}:v]{scale}trim=end_frame=1,setpts=PTS-STARTPTS[v{i}]" for i in range(len(missing))]
+        # 拼接后按序号重写为每秒一帧并以 -r 1 输出，否则会按源帧率补帧/丢帧 (不依赖 FFmpeg 5.1 才有的 -fps_mode)
+        graph.append("".join(f"[v{i}]" for i in range(len(missing))) + f"concat=n={len(missing)}:v=1:a=0,settb=1,setpts=N[out]")
+        command.extend(['-filter_complex', ";".join(graph), '-map', '[out]', '-r', '1', '-f', 'rawvideo', '-pix_fmt', 'rgba', 'pipe:1'])
+        with tempfile.TemporaryFile() as stderr_file:
+            try: frames = list(_iter_raw_frames(command, frame_size, stderr_file))
+            except subprocess.CalledProcessError as e:
+                stderr_file.seek(0); e.stderr = stderr_file.read().decode('utf-8', 'replace'); raise
+        if len(frames) != len(missing): raise RuntimeError(f"只解码出 {len(frames)}/{len(missing)} 帧，时间点可能超出视频长度")
+        for t, frame_img in zip(missing, frames):
+            found[t] = frame_img
+            if cache: _preview_cache_put('decoded', (base_key, t), frame_img)
+        if timings is not None: timings['decode'] = time.perf_counter() - started
+    return [((base_key, t), found[t]) for t in timestamps]
+
+def render_preview_frames(settings, timestamps, cache=True, decoded=None):
+    """按当前参数渲染各时间点的成品帧，返回 (图像列表, 各阶段实际重算的耗时 {阶段: 秒})；cache 为 False 时不写入缓存
+    decoded 为调用方已经用 decode_preview_frames 解码好的源帧，提供时不再解码。"""
+    pro, com = settings['processing'], settings['composition']
+    pro_key = json.dumps(pro, sort_keys=True) if pro['enabled'] else None
+    com_key = json.dumps(com, sort_keys=True) if com['enabled'] else None
+    timings = {}
+    if decoded is None: decoded = decode_preview_frames(settings, timestamps, timings, cache)
+    results = []
+    for frame_key, frame_img in decoded:
+        processed_key = (frame_key, pro_key)
+        processed = _PREVIEW_CACHE['processed'].get(processed_key)
+        if processed is None:
+            started = time.perf_counter()
+            if pro['enabled']:
+                processed = frame_img.copy()
+                processed.putalpha(get_effects_mask(processed.size, pro))
+            else: processed = frame_img.convert("RGB") # 与流式模式一致: 视频帧本身不透明
+            if cache: _preview_cache_put('processed', processed_key, processed)
+            timings['mask'] = timings.get('mask', 0.0) + time.perf_counter() - started
+        composed = processed
+        if com['enabled']:
+            composed_key = (processed_key, com_key)
+            composed = _PREVIEW_CACHE['composed'].get(composed_key)
+            if composed is None:
+                started = time.perf_counter()
+                composed = compose_frame(processed, com)
+                if cache: _preview_cache_put('composed', composed_key, composed)
+                timings['composite'] = timings.get('composite', 0.0) + time.perf_counter() - started
+        results.append(composed)
+    return results, timings
+
+def build_contact_sheet(frames):
+    """把多帧按网格排成一张联系表 (透明背景)，过宽时等比缩小各格"""
+    columns = ceil(len(frames) ** 0.5)
+    rows = ceil(len(frames) / columns)
+    frame_w, frame_h = frames[0].size
+    ratio = min(1.0, (PREVIEW_SHEET_MAX_WIDTH - PREVIEW_SHEET_GAP * (columns + 1)) / (frame_w * columns))
+    tile_w, tile_h = max(1, floor(frame_w * ratio)), max(1, floor(frame_h * ratio))
+    sheet = Image.new('RGBA', (columns * tile_w + (columns + 1) * PREVIEW_SHEET_GAP, rows * tile_h + (rows + 1) * PREVIEW_SHEET_GAP))
+    for i, frame_img in enumerate(frames):
+        tile = frame_img.convert('RGBA')
+        if ratio < 1.0: tile = tile.resize((tile_w, tile_h), Image.LANCZOS)
+        sheet.paste(tile, (PREVIEW_SHEET_GAP + (i % columns) * (tile_w + PREVIEW_SHEET_GAP), PREVIEW_SHEET_GAP + (i // columns) * (tile_h + PREVIEW_SHEET_GAP)))
+    return sheet
+
+def _open_preview_file(path, console):
+    try:
+        if platform.system() == "Windows": os.startfile(path)
+        elif platform.system() == "Darwin": subprocess.call(['open', path])
+        else: subprocess.call(['xdg-open', path])
+    except Exception:
+        console.print(f"[red]自动打开失败，请手动查看文件:[/red]", path)
+
+def generate_preview(settings, count=1):
+    """生成预览: count 为 1 时预览视频正中间的一帧 (按输出格式编码)，否则生成均匀取样的多帧联系表"""
     console = Console()
     input_file = settings['paths']['input']
-    preview_temp_path = os.path.join(os.path.dirname(settings['paths']['output']), "temp_preview_image.png")
-    console.print("\n[bold cyan]--- 正在生成单帧预览 ---[/bold cyan]")
+    preview_folder = os.path.dirname(settings['paths']['output'])
+    console.print("\n[bold cyan]--- 正在生成预览 ---[/bold cyan]" if count == 1 else f"\n[bold cyan]--- 正在生成 {count} 帧联系表 ---[/bold cyan]")
     try:
-        with console.status("[bold green]正在分析视频...", spinner="dots"):
-            duration_str = subprocess.check_output(['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', input_file]).decode('utf-8').strip()
-            duration = float(duration_str)
-            middle_point = duration / 2
-        console.print("[yellow]步骤 1/3: 提取预览帧...[/yellow]")
-        vf_filters = []
-        scale_filter = _get_scale_filter(settings['scaling'], settings['original_dims'])
-        if scale_filter: vf_filters.append(scale_filter)
-        extract_command = ['ffmpeg', '-ss', str(middle_point), '-i', input_file, '-vframes', '1']
-        if vf_filters: extract_command.extend(['-vf', ",".join(vf_filters)])
-        extract_command.extend(['-y', '-update', '1', preview_temp_path])
-        subprocess.run(extract_command, check=True, capture_output=True, text=True)
-        console.print("[green]预览帧提取成功！[/green]")
-        if settings['processing']['enabled']:
-            console.print("[yellow]步骤 2/3: 加工预览帧...[/yellow]")
-            apply_effects_to_image(preview_temp_path, settings['processing'], console)
-            console.print("[green]预览帧加工成功！[/green]")
-        else: console.print("[dim]步骤 2/3: 图片加工已跳过。[/dim]")
-        if settings['composition']['enabled']:
-            console.print("[yellow]步骤 3/3: 合成预览帧...[/yellow]")
-            frame_img = Image.open(preview_temp_path)
-            comp_settings = settings['composition']
-            canvas_w, canvas_h = comp_settings['width'], comp_settings['height']
-            bg_color_rgb = hex_to_rgb(comp_settings['bg_color'])
-            bg_alpha = floor(255 * (comp_settings['bg_opacity'] / 100))
-            bg_color_rgba = (*bg_color_rgb, bg_alpha)
-            canvas = Image.new('RGBA', (canvas_w, canvas_h), bg_color_rgba)
-            paste_x = (canvas_w - frame_img.width) // 2
-            paste_y = (canvas_h - frame_img.height) // 2
-            canvas.paste(frame_img, (paste_x, paste_y), frame_img)
-            canvas.save(preview_temp_path)
-            console.print("[green]预览帧合成成功！[/green]")
-        else: console.print("[dim]步骤 3/3: 画布合成已跳过。[/dim]")
+        duration = probe_video(input_file).duration
+        if not duration: raise RuntimeError("无法获取视频时长")
+        timestamps = window_timestamps(settings, duration, count)
+        frames, timings = render_preview_frames(settings, timestamps)
+        stage_labels = (('decode', '解码'), ('mask', '加工'), ('composite', '合成'))
+        console.print("[dim]" + "，".join(f"{label}: {timings[stage] * 1000:.1f} ms" if stage in timings else f"{label}: 缓存" for stage, label in stage_labels) + "[/dim]")
+        if count == 1:
+            # 按输出格式编码预览帧 (动画格式以单帧 PNG 代替)，调色板只取自预览帧本身
+            output_format = settings['output']['format'] if settings['output']['format'] not in ANIMATION_FILENAMES else 'png'
+            encoder = {'format': output_format, 'compress_level': settings['output']['compress_level'], 'palette': build_shared_palette(frames) if output_format == 'palette' else None, 'final': True}
+            preview_path = os.path.join(preview_folder, output_frame_name("temp_preview_output.png", encoder))
+            started = time.perf_counter()
+            encode_frame(frames[0], preview_path, encoder)
+            console.print(f"[dim]编码: {OUTPUT_FORMAT_LABELS[output_format]} (压缩级别 {encoder['compress_level']})，{os.path.getsize(preview_path) / 1024:.1f} KB，耗时 {(time.perf_counter() - started) * 1000:.1f} ms[/dim]")
+        else:
+            preview_path = os.path.join(preview_folder, "temp_preview_sheet.png")
+            build_contact_sheet(frames).save(preview_path, "PNG", compress_level=FAST_COMPRESS_LEVEL)
+            console.print("[dim]各格时间点 (从左到右、从上到下): " + "  ".join(f"{t:.2f}s" for t in timestamps) + "[/dim]")
         console.print(f"[green]预览生成成功！正在尝试打开...[/green]")
-        try:
-            if platform.system() == "Windows": os.startfile(preview_temp_path)
-            elif platform.system() == "Darwin": subprocess.call(['open', preview_temp_path])
-            else: subprocess.call(['xdg-open', preview_temp_path])
-        except Exception:
-            console.print(f"[red]自动打开失败，请手动查看文件:[/red]", preview_temp_path)
+        _open_preview_file(preview_path, console)
     except Exception as e:
         console.print(f"\n[bold red]预览失败！错误:[/bold red] {e}")
         if isinstance(e, subprocess.CalledProcessError): console.print(f"FFmpeg 错误信息: \n{e.stderr}")
     console.input("\n预览结束，按 Enter 返回配置菜单...")
-    if os.path.exists(preview_temp_path): os.remove(preview_temp_path)
+    for name in ("temp_preview_sheet.png", *("temp_preview_output" + ext for ext in set(_FRAME_EXTENSIONS.values()))):
+        path = os.path.join(preview_folder, name)
+        if os.path.exists(path): os.remove(path)
+
+EXECUTION_MODE_LABELS = {'classic': '经典 (临时目录)', 'stream': '流式 (内存管道)', 'bounded': '有界流水线 (多进程)', 'ffmpeg': 'FFmpeg 原生 (滤镜图)'}
 
 def configure_settings_interactively(initial_settings, console):
     settings = json.loads(json.dumps(initial_settings))
@@ -351,43 +1791,325 @@ def configure_settings_interactively(initial_settings, console):
             except (ValueError, IndexError): console.print("[red]输入无效，请确保格式正确。[/red]"); time.sleep(1)
 
     while True:
-        clear_screen(); orig_w, orig_h = settings['original_dims']; ext, sca, pro, com = settings['extraction'], settings['scaling'], settings['processing'], settings['composition']
+        clear_screen(); orig_w, orig_h = settings['original_dims']; ext, sca, pro, com, exe, ded, out = settings['extraction'], settings['scaling'], settings['processing'], settings['composition'], settings['execution'], settings['dedup'], settings['output']
+        atl = settings['atlas']
         console.print(Panel("[bold cyan]--- 请配置您的处理任务 ---[/bold cyan]"))
-        console.print(Text.from_markup("\n--- [green]模块1: 图片帧提取[/green] ---")); console.print(f"  [bold]1.[/bold] [dim]源视频文件:[/dim] [cyan]{os.path.basename(settings['paths']['input'])}[/cyan]"); console.print(f"  [bold]2.[/bold] [dim]任务输出位置:[/dim] [cyan]{settings['paths']['output']}[/cyan]"); console.print(f"  [bold]3.[/bold] [dim]帧率 (FPS):[/dim] [yellow]{ext['fps']}[/yellow]"); console.print(f"     [dim]原始尺寸:[/dim] {orig_w} x {orig_h}")
-        console.print(Text.from_markup("\n--- [green]模块2: 图片剪裁与缩放[/green] ---")); console.print(f"  [bold]4.[/bold] [dim]启用缩放:[/dim] {'[bold green]是[/bold green]' if sca['enabled'] else '[bold red]否[/bold red]'}")
-        console.print(f"  [bold]5.[/bold] [dim]配置缩放模式与参数... (当前: {sca['mode']})[/dim]")
-        console.print(Text.from_markup("\n--- [green]模块3: 图片加工[/green] ---")); console.print(f"  [bold]6.[/bold] [dim]启用图片加工:[/dim] {'[bold green]是[/bold green]' if pro['enabled'] else '[bold red]否[/bold red]'}")
-        console.print(f"  [bold]7.[/bold] [dim]效果叠加顺序:[/dim] [yellow]{'标准柔和 (C-F-B)' if pro.get('order', 'C-F-B') == 'C-F-B' else '轮廓感 (C-B-F)'}[/yellow]")
-        console.print(f"  [bold]8.[/bold] [dim]边缘虚化 (上/下/左/右):[/dim] [yellow]{pro['feathering']['top']}/{pro['feathering']['bottom']}/{pro['feathering']['left']}/{pro['feathering']['right']}[/yellow]")
-        console.print(f"  [bold]9.[/bold] [dim]圆角比例:[/dim] [yellow]{pro['corner_radius']}%[/yellow]")
-        console.print(f" [bold]10.[/bold] [dim]边缘模糊强度:[/dim] [yellow]{pro['blur_strength']}[/yellow]")
-        console.print(Text.from_markup("\n--- [green]模块4: 画布合成[/green] ---")); console.print(f" [bold]11.[/bold] [dim]启用画布合成:[/dim] {'[bold green]是[/bold green]' if com['enabled'] else '[bold red]否[/bold red]'}")
-        console.print(f" [bold]12.[/bold] [dim]画布大小 (宽x高):[/dim] [yellow]{com['width']}x{com['height']}[/yellow]"); console.print(f" [bold]13.[/bold] [dim]叠底画布颜色:[/dim] [yellow]{com['bg_color']}[/yellow]"); console.print(f" [bold]14.[/bold] [dim]叠底画布透明度:[/dim] [yellow]{com['bg_opacity']}%[/yellow]")
-        console.print(Text.from_markup("\n--- [cyan]执行操作[/cyan] ---")); console.print("[bold]S.[/bold] 开始处理   [bold]P.[/bold] 生成预览   [bold]R.[/bold] 重置所有配置   [bold]Q.[/bold] 退出")
+        console.print(Text.from_markup("\n--- [green]模块1: 图片帧提取[/green] ---")); console.print(f"  [bold]1.[/bold] [dim]源视频文件:[/dim] [cyan]{os.path.basename(settings['paths']['input'])}[/cyan]"); console.print(f"  [bold]2.[/bold] [dim]任务输出位置:[/dim] [cyan]{settings['paths']['output']}[/cyan]"); console.print(f"  [bold]3.[/bold] [dim]帧率 (FPS):[/dim] [yellow]{ext['fps']}[/yellow]"); console.print(f"  [bold]4.[/bold] [dim]分段并行提取 (段数):[/dim] [yellow]{ext['segments']}[/yellow]"); console.print(f"  [bold]5.[/bold] [dim]时间范围 (秒):[/dim] [yellow]{ext['start'] or 0:g} - {ext['end'] or '结尾'}[/yellow]")
+        select_detail = {'nth': f" (N = {ext['every_nth']})", 'list': f" ({len(ext['frames'])} 帧)"}.get(ext['select'], "")
+        console.print(f"  [bold]6.[/bold] [dim]选帧方式:[/dim] [yellow]{FRAME_SELECT_LABELS[ext['select']]}{select_detail}[/yellow]"); console.print(f"  [bold]7.[/bold] [dim]修改 N / 帧号列表...[/dim]"); console.print(f"     [dim]原始尺寸:[/dim] {orig_w} x {orig_h}  [dim]({describe_video(probe_video(settings['paths']['input']))})[/dim]")
+        console.print(Text.from_markup("\n--- [green]模块2: 图片剪裁与缩放[/green] ---")); console.print(f"  [bold]8.[/bold] [dim]启用缩放:[/dim] {'[bold green]是[/bold green]' if sca['enabled'] else '[bold red]否[/bold red]'}")
+        console.print(f"  [bold]9.[/bold] [dim]配置缩放模式与参数... (当前: {sca['mode']})[/dim]")
+        console.print(Text.from_markup("\n--- [green]模块3: 图片加工[/green] ---")); console.print(f" [bold]10.[/bold] [dim]启用图片加工:[/dim] {'[bold green]是[/bold green]' if pro['enabled'] else '[bold red]否[/bold red]'}")
+        console.print(f" [bold]11.[/bold] [dim]效果叠加顺序:[/dim] [yellow]{'标准柔和 (C-F-B)' if pro.get('order', 'C-F-B') == 'C-F-B' else '轮廓感 (C-B-F)'}[/yellow]")
+        console.print(f" [bold]12.[/bold] [dim]边缘虚化 (上/下/左/右):[/dim] [yellow]{pro['feathering']['top']}/{pro['feathering']['bottom']}/{pro['feathering']['left']}/{pro['feathering']['right']}[/yellow]")
+        console.print(f" [bold]13.[/bold] [dim]圆角比例:[/dim] [yellow]{pro['corner_radius']}%[/yellow]")
+        console.print(f" [bold]14.[/bold] [dim]边缘模糊强度:[/dim] [yellow]{pro['blur_strength']}[/yellow]")
+        console.print(Text.from_markup("\n--- [green]模块4: 画布合成[/green] ---")); console.print(f" [bold]15.[/bold] [dim]启用画布合成:[/dim] {'[bold green]是[/bold green]' if com['enabled'] else '[bold red]否[/bold red]'}")
+        console.print(f" [bold]16.[/bold] [dim]画布大小 (宽x高):[/dim] [yellow]{com['width']}x{com['height']}[/yellow]"); console.print(f" [bold]17.[/bold] [dim]叠底画布颜色:[/dim] [yellow]{com['bg_color']}[/yellow]"); console.print(f" [bold]18.[/bold] [dim]叠底画布透明度:[/dim] [yellow]{com['bg_opacity']}%[/yellow]")
+        console.print(Text.from_markup("\n--- [green]模块5: 执行设置[/green] ---")); console.print(f" [bold]19.[/bold] [dim]执行模式:[/dim] [yellow]{EXECUTION_MODE_LABELS[exe['mode']]}[/yellow]"); console.print(f" [bold]20.[/bold] [dim]并行进程数 (步骤2/3):[/dim] [yellow]{exe['workers']}[/yellow]"); console.print(f" [bold]21.[/bold] [dim]结果缓存与断点续传:[/dim] {'[bold green]是[/bold green]' if exe['resume'] else '[bold red]否[/bold red]'}")
+        console.print(f" [bold]22.[/bold] [dim]写出运行报告:[/dim] {'[bold green]是[/bold green]' if exe['report'] else '[bold red]否[/bold red]'}"); console.print(f" [bold]23.[/bold] [dim]cProfile 性能剖析:[/dim] {'[bold green]是[/bold green]' if exe['profile'] else '[bold red]否[/bold red]'}")
+        console.print(f" [bold]24.[/bold] [dim]资源预检 (磁盘不足时中止):[/dim] {'[bold green]是[/bold green]' if exe['preflight'] else '[bold red]否[/bold red]'}"); console.print(f" [bold]25.[/bold] [dim]最多在途帧数 (有界流水线):[/dim] [yellow]{exe['max_in_flight']}[/yellow]"); console.print(f" [bold]26.[/bold] [dim]临时帧目录:[/dim] [cyan]{exe['temp_dir'] or '输出目录内'}[/cyan]")
+        console.print(Text.from_markup("\n--- [green]模块6: 重复帧检测[/green] ---")); console.print(f" [bold]27.[/bold] [dim]启用重复帧检测:[/dim] {'[bold green]是[/bold green]' if ded['enabled'] else '[bold red]否[/bold red]'}")
+        console.print(f" [bold]28.[/bold] [dim]判定阈值 (0 为完全相同):[/dim] [yellow]{ded['threshold']}[/yellow]"); console.print(f" [bold]29.[/bold] [dim]重复帧输出方式:[/dim] [yellow]{DEDUP_OUTPUT_LABELS[ded['output']]}[/yellow]")
+        console.print(Text.from_markup("\n--- [green]模块7: 输出编码[/green] ---")); console.print(f" [bold]30.[/bold] [dim]输出格式:[/dim] [yellow]{OUTPUT_FORMAT_LABELS[out['format']]}[/yellow]"); console.print(f" [bold]31.[/bold] [dim]压缩级别 (0 最快 - 9 最小):[/dim] [yellow]{out['compress_level']}[/yellow]")
+        console.print(Text.from_markup("\n--- [green]模块8: 精灵图集[/green] ---")); console.print(f" [bold]32.[/bold] [dim]打包为精灵图集 (裁剪透明边):[/dim] {'[bold green]是[/bold green]' if atl['enabled'] else '[bold red]否[/bold red]'}"); console.print(f" [bold]33.[/bold] [dim]图集最大边长:[/dim] [yellow]{atl['max_size']}px[/yellow]")
+        console.print(Text.from_markup("\n--- [cyan]执行操作[/cyan] ---")); console.print("[bold]S.[/bold] 开始处理   [bold]P.[/bold] 生成预览   [bold]M.[/bold] 多帧联系表预览   [bold]R.[/bold] 重置所有配置   [bold]Q.[/bold] 退出")
         choice = console.input("\n[bold]请输入编号修改配置或执行操作:[/bold] ").upper()
         if choice == 'Q': return None
         if choice == 'R': settings = json.loads(json.dumps(initial_settings)); console.print("[green]所有配置已重置为默认值。[/green]"); time.sleep(1); continue
         if choice == 'S': return settings
         if choice == 'P': generate_preview(settings); continue
+        if choice == 'M':
+            try: count = int(console.input(f"联系表帧数 (2-{PREVIEW_SHEET_MAX_FRAMES}，回车默认 {PREVIEW_SHEET_FRAMES}): ") or PREVIEW_SHEET_FRAMES)
+            except ValueError: count = PREVIEW_SHEET_FRAMES
+            generate_preview(settings, min(PREVIEW_SHEET_MAX_FRAMES, max(2, count))); continue
         try:
             if choice == '3': ext['fps'] = int(console.input("新帧率 (1-120): "))
-            elif choice == '4': sca['enabled'] = not sca['enabled']
-            elif choice == '5': scaling_submenu()
-            elif choice == '6': pro['enabled'] = not pro['enabled']
-            elif choice == '7': pro['order'] = 'C-B-F' if pro.get('order', 'C-F-B') == 'C-F-B' else 'C-F-B'
-            elif choice == '8':
+            elif choice == '4': ext['segments'] = max(1, int(console.input("新分段数 (1 为不分段): ")))
+            elif choice == '5':
+                start, _, end = console.input("新时间范围 起点,终点 (秒，终点留空为到结尾): ").partition(',')
+                ext['start'], ext['end'] = max(0.0, float(start or 0)), float(end) if end.strip() else None
+            elif choice == '6': modes = list(FRAME_SELECT_LABELS); ext['select'] = modes[(modes.index(ext['select']) + 1) % len(modes)]
+            elif choice == '7':
+                if ext['select'] == 'list': ext['frames'] = parse_frame_list(console.input("帧号列表 (相对于起始时间，如 0,12,30-40): "))
+                else: ext['every_nth'] = max(1, int(console.input("每 N 帧取 1 帧，N = ")))
+            elif choice == '8': sca['enabled'] = not sca['enabled']
+            elif choice == '9': scaling_submenu()
+            elif choice == '10': pro['enabled'] = not pro['enabled']
+            elif choice == '11': pro['order'] = 'C-B-F' if pro.get('order', 'C-F-B') == 'C-F-B' else 'C-F-B'
+            elif choice == '12':
                 console.print("请输入新的边缘虚化值 (上,下,左,右)，用逗号分隔:")
                 vals = list(map(int, console.input("> ").split(','))); pro['feathering'].update({'top': vals[0], 'bottom': vals[1], 'left': vals[2], 'right': vals[3]})
-            elif choice == '9': pro['corner_radius'] = int(console.input("新圆角比例 (0-50): "))
-            elif choice == '10': pro['blur_strength'] = int(console.input("新模糊强度 (0-50): "))
-            elif choice == '11': com['enabled'] = not com['enabled']
-            elif choice == '12': w, h = map(int, console.input("新画布宽高 (宽,高): ").split(',')); com['width'], com['height'] = w, h
-            elif choice == '13': com['bg_color'] = console.input("新背景色 (#RRGGBB): ")
-            elif choice == '14': com['bg_opacity'] = int(console.input("新背景透明度 (0-100): "))
+            elif choice == '13': pro['corner_radius'] = int(console.input("新圆角比例 (0-50): "))
+            elif choice == '14': pro['blur_strength'] = int(console.input("新模糊强度 (0-50): "))
+            elif choice == '15': com['enabled'] = not com['enabled']
+            elif choice == '16': w, h = map(int, console.input("新画布宽高 (宽,高): ").split(',')); com['width'], com['height'] = w, h
+            elif choice == '17': com['bg_color'] = console.input("新背景色 (#RRGGBB): ")
+            elif choice == '18': com['bg_opacity'] = int(console.input("新背景透明度 (0-100): "))
+            elif choice == '19': modes = list(EXECUTION_MODE_LABELS); exe['mode'] = modes[(modes.index(exe['mode']) + 1) % len(modes)]
+            elif choice == '20': exe['workers'] = max(1, int(console.input(f"新并行进程数 (1-{os.cpu_count() or 1}): ")))
+            elif choice == '21': exe['resume'] = not exe['resume']
+            elif choice == '22': exe['report'] = not exe['report']
+            elif choice == '23': exe['profile'] = not exe['profile']
+            elif choice == '24': exe['preflight'] = not exe['preflight']
+            elif choice == '25': exe['max_in_flight'] = max(1, int(console.input("新的最多在途帧数 (建议为并行进程数的 2 倍以上): ")))
+            elif choice == '26':
+                exe['temp_dir'] = console.input("新的临时帧目录 (如 /dev/shm，直接回车恢复为输出目录内): ").strip().replace("'", "")
+                settings['paths']['temp_extraction_folder'] = temp_extraction_folder(settings['paths']['output'], exe['temp_dir'])
+            elif choice == '27': ded['enabled'] = not ded['enabled']
+            elif choice == '28': ded['threshold'] = max(0, int(console.input("新判定阈值 (0-255，单通道最大像素差): ")))
+            elif choice == '29': outputs = list(DEDUP_OUTPUT_LABELS); ded['output'] = outputs[(outputs.index(ded['output']) + 1) % len(outputs)]
+            elif choice == '30': formats = list(OUTPUT_FORMAT_LABELS); out['format'] = formats[(formats.index(out['format']) + 1) % len(formats)]
+            elif choice == '31': out['compress_level'] = min(9, max(0, int(console.input("新压缩级别 (0-9): "))))
+            elif choice == '32': atl['enabled'] = not atl['enabled']
+            elif choice == '33': atl['max_size'] = max(64, int(console.input("新图集最大边长 (如 2048、4096): ")))
             else: console.print("[red]无效的选项，请重试。[/red]"); time.sleep(1)
         except (ValueError, IndexError): console.print("[red]输入无效，请确保输入了正确的格式。[/red]"); time.sleep(1)
 
-def main():
+def default_output_folder(input_file):
+    """默认输出目录: 视频所在文件夹下的同名目录"""
+    return os.path.join(os.path.dirname(input_file), os.path.splitext(os.path.basename(input_file))[0])
+
+def temp_extraction_folder(output_folder, temp_dir=None):
+    """临时帧目录: 默认位于输出目录内；指定 temp_dir (如 tmpfs 挂载点) 时按输出目录生成唯一的子目录，避免并发任务互相覆盖"""
+    if not temp_dir: return os.path.join(output_folder, "temp_frames_PicoPico")
+    return os.path.join(temp_dir, f"temp_frames_PicoPico_{hashlib.sha1(os.path.abspath(output_folder).encode('utf-8')).hexdigest()[:10]}")
+
+def build_default_settings(input_file, output_folder, original_dims):
+    """生成一次任务的默认配置 (交互模式与批处理模式共用同一结构)"""
+    return {
+        'paths': {'input': input_file, 'output': output_folder, 'temp_extraction_folder': temp_extraction_folder(output_folder)},
+        'original_dims': original_dims,
+        'extraction': {'fps': 40, 'segments': 1, 'start': 0, 'end': None, 'select': 'fps', 'every_nth': 2, 'frames': []},
+        'scaling': { 'enabled': True, 'mode': 'A', 'a_width': 750, 'b_height': 1624, 'c_width': 750, 'c_height': 1504, 'd_height': 1624, 'd_width': 750, 'e_percent': 100 },
+        'processing': {'enabled': True, 'order': 'C-F-B', 'feathering': {'top': 5, 'bottom': 5, 'left': 5, 'right': 5}, 'corner_radius': 20, 'blur_strength': 10},
+        'composition': {'enabled': False, 'width': 750, 'height': 1624, 'bg_color': '#000000', 'bg_opacity': 0, 'mode': 'center'},
+        'execution': {'mode': 'classic', 'workers': 1, 'resume': True, 'report': False, 'profile': False, 'preflight': False, 'max_in_flight': 8, 'temp_dir': '', 'ffmpeg_threads': 0},
+        'dedup': {'enabled': False, 'threshold': 0, 'output': 'link'},
+        'output': {'format': 'png', 'compress_level': DEFAULT_COMPRESS_LEVEL},
+        'atlas': {'enabled': False, 'max_size': DEFAULT_ATLAS_SIZE}
+    }
+
+def _merge_settings(base, overrides):
+    """将 overrides 递归合并到 base (原地修改)，未提供的键保留默认值"""
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(base.get(key), dict): _merge_settings(base[key], value)
+        else: base[key] = value
+    return base
+
+# --- 无界面批处理 ---
+# 不清屏、不弹出交互菜单与 rich 界面，每个视频的日志写入独立的内存 console，只在失败时摘录到结果汇总中。
+
+def _expand_inputs(patterns):
+    """展开输入列表中的通配符，去重 (按绝对路径，同一文件只处理一次) 并保持顺序"""
+    videos, seen = [], set()
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        for path in matches:
+            key = os.path.normcase(os.path.abspath(path))
+            if key not in seen: seen.add(key); videos.append(path)
+    return videos
+
+def _batch_output_folders(videos, output_root):
+    """为每个视频分配输出目录: 默认为同名子目录；多个视频落到同一目录时 (如 d1/clip.mp4 与 d2/clip.mp4) 各自追加路径哈希，
+    避免互相清除输出帧或共用临时目录"""
+    folders = [os.path.join(output_root, os.path.splitext(os.path.basename(video))[0]) if output_root else default_output_folder(video) for video in videos]
+    keys = [os.path.normcase(os.path.abspath(folder)) for folder in folders]
+    counts = {key: keys.count(key) for key in keys}
+    return [f"{folder}_{hashlib.sha1(os.path.abspath(video).encode('utf-8')).hexdigest()[:8]}" if counts[key] > 1 else folder
+            for video, folder, key in zip(videos, folders, keys)]
+
+def _run_batch_job(input_file, overrides, output_folder, workers, segments, threads):
+    """处理单个视频，返回结果汇总 (状态、帧数、耗时)"""
+    started = time.time()
+    console = Console(file=io.StringIO(), width=120)
+    result = {'input': input_file, 'output': output_folder, 'status': 'failed', 'frames': 0, 'elapsed_seconds': 0.0}
+    try:
+        if not os.path.isfile(input_file): raise FileNotFoundError(f"找不到视频文件: {input_file}")
+        metadata = probe_video(input_file)
+        settings = _merge_settings(build_default_settings(input_file, output_folder, (metadata.width, metadata.height)), overrides)
+        settings['paths']['temp_extraction_folder'] = temp_extraction_folder(output_folder, settings['execution']['temp_dir'])
+        settings['extraction']['frames'] = parse_frame_list(settings['extraction']['frames']) # 配置文件中可写为 "0,12,30-40" 或列表
+        settings['execution']['workers'] = workers
+        settings['execution']['ffmpeg_threads'] = threads
+        settings['extraction']['segments'] = segments
+        if run_pipeline(settings, console): result['status'] = 'ok'
+        if os.path.isdir(output_folder): result['frames'] = len([f for f in os.listdir(output_folder) if is_frame_file(f)])
+    except Exception as e:
+        console.print(f"错误: {e}")
+    if result['status'] != 'ok': result['log'] = console.file.getvalue().strip()[-2000:]
+    result['elapsed_seconds'] = round(time.time() - started, 3)
+    return result
+
+def run_batch(settings_path, input_patterns, jobs=None, output_root=None, summary_path=None):
+    """批处理入口: 按配置文件处理一组视频，返回退出码 (有失败时为 1)"""
+    if not check_ffmpeg():
+        print("错误: 未找到 FFmpeg，请先安装。", file=sys.stderr); return 1
+    with open(settings_path, 'r', encoding='utf-8') as f: overrides = json.load(f)
+    input_patterns = list(input_patterns) + overrides.pop('inputs', [])
+    for key in ('paths', 'original_dims'): overrides.pop(key, None) # 由每个视频自行推算
+    videos = _expand_inputs(input_patterns)
+    if not videos:
+        print("错误: 没有找到任何输入视频。", file=sys.stderr); return 1
+    # 并发任务数 x 每个任务的进程数/分段数/ffmpeg 线程数 不超过 CPU 核心数，避免过度抢占；ffmpeg 默认按全部核心开线程，须显式限制
+    cpu_count = os.cpu_count() or 1
+    jobs = max(1, min(jobs or cpu_count // 2, len(videos), cpu_count))
+    per_job_cores = max(1, cpu_count // jobs)
+    execution, extraction = overrides.get('execution', {}), overrides.get('extraction', {})
+    workers = max(1, min(execution.get('workers', 1), per_job_cores))
+    segments = max(1, min(extraction.get('segments', 1), per_job_cores))
+    threads = max(1, min(execution.get('ffmpeg_threads') or per_job_cores, per_job_cores))
+    print(f"批处理开始: {len(videos)} 个视频，并发 {jobs} 个任务，每个任务 {workers} 个进程 / {segments} 个分段 / {threads} 个 ffmpeg 线程")
+    results = []
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(_run_batch_job, video, json.loads(json.dumps(overrides)), output_folder, workers, segments, threads) for video, output_folder in zip(videos, _batch_output_folders(videos, output_root))]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            print(f"[{result['status']}] {result['input']} -> {result['frames']} 帧, {result['elapsed_seconds']:.1f}s")
+    results.sort(key=lambda r: videos.index(r['input']))
+    summary = {'settings': settings_path, 'jobs': jobs, 'videos': results, 'succeeded': sum(r['status'] == 'ok' for r in results), 'failed': sum(r['status'] != 'ok' for r in results)}
+    summary_path = summary_path or os.path.join(output_root or os.getcwd(), "picopico_batch_summary.json")
+    os.makedirs(os.path.dirname(os.path.abspath(summary_path)), exist_ok=True)
+    with open(summary_path, 'w', encoding='utf-8') as f: json.dump(summary, f, ensure_ascii=False, indent=2)
+    print(f"批处理完成: 成功 {summary['succeeded']}，失败 {summary['failed']}。结果汇总: {summary_path}")
+    return 0 if summary['failed'] == 0 else 1
+
+# --- 基准测试 ---
+# 用 lavfi testsrc 离线生成合成视频，在缩放模式 / 加工 / 合成的参数矩阵下分别计时提取、加工、合成三个步骤。
+# 每个用例在独立的子进程中运行，峰值内存 (RSS) 互不干扰；结果保存为 JSON 以便跨版本对比。
+BENCH_SCALING_MODES = ('A', 'B', 'C', 'D', 'E')
+
+def _peak_rss_mb():
+    """返回当前进程与其子进程 (ffmpeg) 的峰值内存 (MB)，不支持的平台返回 None"""
+    try: import resource
+    except ImportError: return None
+    scale = 1024 * 1024 if platform.system() == "Darwin" else 1024 # macOS 以字节计，Linux 以 KB 计
+    return {'self': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1), 'ffmpeg': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale, 1)}
+
+def _folder_bytes(folder):
+    return sum(entry.stat().st_size for entry in os.scandir(folder) if entry.is_file()) if os.path.isdir(folder) else 0
+
+def generate_synthetic_video(path, width, height, duration, fps):
+    """用 ffmpeg lavfi testsrc 生成一段合成测试视频"""
+    command = ['ffmpeg', '-v', 'error', '-f', 'lavfi', '-i', f"testsrc=size={width}x{height}:rate={fps}:duration={duration}", '-pix_fmt', 'yuv420p', '-y', path]
+    subprocess.run(command, check=True, capture_output=True)
+
+def _bench_case(video_path, video_info, case, work_folder):
+    """子进程任务: 按经典模式依次运行三个步骤并分别计时"""
+    console = Console(file=io.StringIO())
+    output_folder = os.path.join(work_folder, "output")
+    settings = build_default_settings(video_path, output_folder, (video_info['width'], video_info['height']))
+    settings['extraction']['fps'] = case['extract_fps']
+    settings['scaling']['mode'] = case['scaling_mode']
+    settings['processing']['enabled'] = case['effects']
+    settings['composition']['enabled'] = case['composition']
+    settings['output']['format'] = case['output_format']
+    settings['execution'].update({'workers': case['workers'], 'resume': False, 'report': False})
+    reset_metrics()
+    stages, success = {}, True
+    wall_start = time.perf_counter()
+    for stage, module in (('extract', module_1_extract), ('process', module_2_process), ('compose', module_3_compose)):
+        started = time.perf_counter()
+        success = module(settings, console)
+        stages[stage] = {'seconds': round(time.perf_counter() - started, 4)}
+        if not success: break
+    wall_seconds = time.perf_counter() - wall_start
+    frames = len([f for f in os.listdir(output_folder) if is_frame_file(f)]) if success else 0
+    for timing in stages.values(): timing['fps'] = round(frames / timing['seconds'], 2) if frames and timing['seconds'] > 0 else None
+    encode = summarize_frame_stages().get('encode')
+    stages['encode'] = {'seconds': encode['total_seconds'], 'p50_ms': encode['p50_ms'], 'p95_ms': encode['p95_ms']} if encode else {'seconds': 0.0}
+    result = {'video': video_info, **case, 'success': success, 'frames': frames, 'wall_seconds': round(wall_seconds, 4), 'stages': stages,
+              'frame_stages': summarize_frame_stages(), 'peak_rss_mb': _peak_rss_mb(), 'output_bytes': _folder_bytes(output_folder)}
+    if not success: result['log'] = console.file.getvalue().strip()[-2000:]
+    return result
+
+def run_benchmark(resolutions, durations, source_fps_list, extract_fps, workers=1, output_path=None, work_dir=None, output_formats=('png',)):
+    """基准测试入口: 生成合成视频并跑完整个参数矩阵，返回退出码"""
+    if not check_ffmpeg():
+        print("错误: 未找到 FFmpeg，请先安装。", file=sys.stderr); return 1
+    console = Console()
+    work_root = tempfile.mkdtemp(prefix="picopico_bench_", dir=work_dir)
+    ffmpeg_version = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True).stdout.splitlines()[0]
+    report = {'app_version': APP_VERSION, 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(), 'pillow': getattr(Image, '__version__', None),
+              'ffmpeg': ffmpeg_version, 'platform': platform.platform(), 'cpu_count': os.cpu_count(), 'results': []}
+    try:
+        videos = []
+        for (width, height), duration, source_fps in itertools.product(resolutions, durations, source_fps_list):
+            video_path = os.path.join(work_root, f"testsrc_{width}x{height}_{duration}s_{source_fps}fps.mp4")
+            generate_synthetic_video(video_path, width, height, duration, source_fps)
+            metadata = probe_video(video_path)
+            videos.append((video_path, {'width': width, 'height': height, 'duration': duration, 'fps': source_fps, 'frame_count': metadata.frame_count, 'codec': metadata.codec, 'bytes': os.path.getsize(video_path)}))
+        cases = [{'scaling_mode': mode, 'effects': effects, 'composition': composition, 'output_format': output_format, 'extract_fps': extract_fps, 'workers': workers}
+                 for mode, effects, composition, output_format in itertools.product(BENCH_SCALING_MODES, (True, False), (True, False), output_formats)]
+        total = len(videos) * len(cases)
+        with Progress(TextColumn("[progress.description]{task.description}"), BarColumn(), TextColumn("{task.completed}/{task.total}"), TimeRemainingColumn(), console=console) as progress:
+            task = progress.add_task("[green]基准测试中...", total=total)
+            for video_path, video_info in videos:
+                for case in cases:
+                    case_folder = tempfile.mkdtemp(dir=work_root)
+                    # 每个用例使用全新的子进程，峰值内存只反映该用例本身
+                    with ProcessPoolExecutor(max_workers=1) as executor:
+                        report['results'].append(executor.submit(_bench_case, video_path, video_info, case, case_folder).result())
+                    shutil.rmtree(case_folder, ignore_errors=True)
+                    progress.update(task, advance=1)
+    finally:
+        shutil.rmtree(work_root, ignore_errors=True)
+    output_path = output_path or f"picopico_bench_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    with open(output_path, 'w', encoding='utf-8') as f: json.dump(report, f, ensure_ascii=False, indent=2)
+    table = Table(title=f"基准测试结果 (帧/秒) - v{APP_VERSION}")
+    for column in ("视频", "缩放", "加工", "合成", "格式", "帧数", "提取", "加工", "合成", "编码(ms/帧)", "总耗时(s)", "峰值内存(MB)", "输出大小(KB)"): table.add_column(column, justify="right")
+    for r in report['results']:
+        stage_fps = [f"{r['stages'][stage]['fps']:.1f}" if r['stages'].get(stage, {}).get('fps') else '-' for stage in ('extract', 'process', 'compose')]
+        rss = r['peak_rss_mb']['self'] if r['peak_rss_mb'] else '-'
+        encode_ms = f"{r['stages']['encode']['p50_ms']:.1f}" if r['stages'].get('encode', {}).get('p50_ms') is not None else '-'
+        table.add_row(f"{r['video']['width']}x{r['video']['height']}@{r['video']['fps']}", r['scaling_mode'], '是' if r['effects'] else '否', '是' if r['composition'] else '否', r['output_format'], str(r['frames']), *stage_fps, encode_ms, f"{r['wall_seconds']:.2f}", str(rss), str(r['output_bytes'] // 1024))
+    console.print(table)
+    console.print(f"[green]基准测试结果已保存: {output_path}[/green]")
+    return 0 if all(r['success'] for r in report['results']) else 1
+
+def _parse_resolution_list(value):
+    return [tuple(map(int, item.lower().split('x'))) for item in value.split(',') if item]
+
+def _parse_int_list(value):
+    return [int(item) for item in value.split(',') if item]
+
+def _parse_format_list(value):
+    formats = [item for item in value.split(',') if item]
+    for output_format in formats:
+        if output_format not in OUTPUT_FORMAT_LABELS or output_format in ANIMATION_FILENAMES:
+            raise argparse.ArgumentTypeError(f"不支持的逐帧输出格式: {output_format} (可选: png, palette, webp)")
+    return formats
+
+def cli_main(argv):
+    """命令行入口 (无交互)"""
+    parser = argparse.ArgumentParser(prog="feather_extractor.py", description="PicoPico MP4 to PNG 高级处理引擎 (无界面模式)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    batch_parser = subparsers.add_parser('batch', help="按配置文件批量处理视频")
+    batch_parser.add_argument('settings', help="配置 JSON (与交互模式的配置结构相同，可包含 inputs 列表)")
+    batch_parser.add_argument('inputs', nargs='*', help="输入视频路径或通配符 (如 'clips/*.mp4')")
+    batch_parser.add_argument('-j', '--jobs', type=int, default=None, help="同时处理的视频数 (默认: CPU 核心数的一半)")
+    batch_parser.add_argument('-o', '--output-root', default=None, help="输出根目录 (默认: 各视频所在文件夹下的同名目录)")
+    batch_parser.add_argument('--summary', default=None, help="结果汇总 JSON 的路径")
+    bench_parser = subparsers.add_parser('bench', help="用合成视频运行基准测试并输出 JSON 报告")
+    bench_parser.add_argument('--resolutions', type=_parse_resolution_list, default=[(640, 360), (1280, 720)], help="测试视频分辨率列表，如 640x360,1920x1080")
+    bench_parser.add_argument('--durations', type=_parse_int_list, default=[2], help="测试视频时长列表 (秒)，如 2,10")
+    bench_parser.add_argument('--source-fps', type=_parse_int_list, default=[30], help="测试视频帧率列表，如 24,60")
+    bench_parser.add_argument('--extract-fps', type=int, default=20, help="提取帧率 (默认: 20)")
+    bench_parser.add_argument('--workers', type=int, default=1, help="步骤 2/3 的并行进程数 (默认: 1)")
+    bench_parser.add_argument('--formats', type=_parse_format_list, default=['png'], help="逐帧输出格式列表，如 png,palette,webp (默认: png)")
+    bench_parser.add_argument('--out', default=None, help="报告 JSON 的路径")
+    bench_parser.add_argument('--work-dir', default=None, help="存放临时视频与帧的目录 (默认: 系统临时目录)")
+    args = parser.parse_args(argv)
+    if args.command == 'batch':
+        return run_batch(args.settings, args.inputs, args.jobs, args.output_root, args.summary)
+    if args.command == 'bench':
+        return run_benchmark(args.resolutions, args.durations, args.source_fps, args.extract_fps, args.workers, args.out, args.work_dir, args.formats)
+    return 0
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv: return cli_main(argv)
     console = Console()
     clear_screen()
     console.print(Panel("[bold green]      PicoPico MP4 to PNG 高级处理引擎 v5.0 (最终交付版)[/bold green]"))
@@ -404,32 +2126,21 @@ def main():
         else: console.print("[red]路径无效或不是 .mp4 文件，请重试。[/red]")
     console.print("\n请输入输出文件夹路径 (直接回车，则在视频所在文件夹下创建同名目录):")
     output_path = input("> ").strip().replace("'", "").strip()
-    if not output_path:
-        output_folder = os.path.join(os.path.dirname(input_file), os.path.splitext(os.path.basename(input_file))[0])
+    if not output_path: output_folder = default_output_folder(input_file)
     else: output_folder = output_path
-    temp_folder = os.path.join(output_folder, "temp_frames_PicoPico")
-    orig_w, orig_h = get_video_dimensions(input_file, console)
-    if not orig_w: input("按 Enter 退出。"); return
-    initial_settings = {
-        'paths': {'input': input_file, 'output': output_folder, 'temp_extraction_folder': temp_folder},
-        'original_dims': (orig_w, orig_h),
-        'extraction': {'fps': 40},
-        'scaling': { 'enabled': True, 'mode': 'A', 'a_width': 750, 'b_height': 1624, 'c_width': 750, 'c_height': 1504, 'd_height': 1624, 'd_width': 750, 'e_percent': 100 },
-        'processing': {'enabled': True, 'order': 'C-F-B', 'feathering': {'top': 5, 'bottom': 5, 'left': 5, 'right': 5}, 'corner_radius': 20, 'blur_strength': 10},
-        'composition': {'enabled': False, 'width': 750, 'height': 1624, 'bg_color': '#000000', 'bg_opacity': 0, 'mode': 'center'}
-    }
+    try: metadata = probe_video(input_file)
+    except RuntimeError as e:
+        console.print(f"[red]错误：无法获取视频信息。请检查文件路径和 FFprobe 是否正常。[/red]")
+        console.print(f"[dim]{e}[/dim]"); input("按 Enter 退出。"); return
+    initial_settings = build_default_settings(input_file, output_folder, (metadata.width, metadata.height))
     final_settings = configure_settings_interactively(initial_settings, console)
     if not final_settings:
         console.print("\n操作已取消。"); time.sleep(1); return
     clear_screen()
     console.print(Panel(f"[bold blue]任务开始: {os.path.basename(input_file)}[/bold blue]"))
-    if os.path.exists(temp_folder): shutil.rmtree(temp_folder)
-    if module_1_extract(final_settings, console):
-        if module_2_process(final_settings, console):
-            module_3_compose(final_settings, console)
-    if os.path.exists(temp_folder): shutil.rmtree(temp_folder)
+    run_pipeline(final_settings, console)
     console.print(Panel(f"[bold green]所有流程执行完毕！\n输出文件夹: {final_settings['paths']['output']}[/bold green]"))
     input("\n按 Enter 键退出。")
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
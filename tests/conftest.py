@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import feather_extractor as fe
+
+
+def fake_metadata(duration=10.0, fps=25.0, width=640, height=360):
+    return fe.VideoMetadata(width=width, height=height, coded_width=width, coded_height=height, rotation=0, fps=fps,
+                            frame_count=int(duration * fps) if duration else None, duration=duration, codec='h264', pix_fmt='yuv420p')
+
+
+@pytest.fixture
+def fake_probe(monkeypatch):
+    """替换 probe_video，测试无需 ffprobe 与真实视频；返回可修改的元数据容器"""
+    state = {'metadata': fake_metadata()}
+    monkeypatch.setattr(fe, 'probe_video', lambda path: state['metadata'])
+    return state
+
+
+@pytest.fixture
+def settings(tmp_path, fake_probe):
+    video = tmp_path / "input.mp4"
+    video.write_bytes(b"not really a video" * 64)
+    return fe.build_default_settings(str(video), str(tmp_path / "out"), (640, 360))
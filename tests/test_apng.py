@@ -0,0 +1,63 @@
+from fractions import Fraction
+
+import pytest
+from PIL import Image
+
+import feather_extractor as fe
+
+
+@pytest.mark.parametrize('repeat, rate, expected', [
+    (1, Fraction(30), (1, 30)),
+    (3, Fraction(30000, 1001), (3003, 30000)),
+    (3, Fraction(120000, 1001), (1001, 40000)),
+])
+def test_apng_delay_exact_when_it_fits(repeat, rate, expected):
+    assert fe._apng_delay(repeat, rate) == expected
+
+
+@pytest.mark.parametrize('repeat, rate', [(1, Fraction(120000, 1001)), (70000, Fraction(1)), (1, Fraction(100000)), (7, Fraction(65537, 3))])
+def test_apng_delay_fits_sixteen_bits(repeat, rate):
+    numerator, denominator = fe._apng_delay(repeat, rate)
+    assert 0 < denominator <= 0xFFFF and 0 <= numerator <= 0xFFFF
+    exact = repeat / rate
+    if exact < 0xFFFF: assert abs(Fraction(numerator, denominator) - exact) <= exact * Fraction(1, 10000) + Fraction(1, 0xFFFF)
+
+
+def _frames(tmp_path, count, size=(6, 4)):
+    paths = []
+    for i in range(count):
+        path = tmp_path / f"{i:06d}.png"
+        Image.new('RGBA', size, (i * 40, 0, 255 - i * 40, 128)).save(path)
+        paths.append(str(path))
+    return paths
+
+
+def test_write_apng_chunk_layout(tmp_path):
+    paths = _frames(tmp_path, 3)
+    output = tmp_path / "anim.png"
+    fe.write_apng(str(output), [(paths[0], 1), (paths[1], 2), (paths[2], 1)], 10)
+    data = output.read_bytes()
+    assert data[:8] == b'\x89PNG\r\n\x1a\n'
+    chunks = fe._png_chunks(data)
+    types = [chunk_type for chunk_type, _ in chunks]
+    assert types[:2] == [b'IHDR', b'acTL'] and types[-1] == b'IEND'
+    assert types.index(b'fcTL') < types.index(b'IDAT') < types.index(b'fdAT') # 首帧的 IDAT 兼作静态默认图像
+    assert int.from_bytes(dict(chunks)[b'acTL'][:4], 'big') == 3
+    # fcTL 与 fdAT 共用一个从 0 开始、连续递增的序号
+    sequence = [int.from_bytes(payload[:4], 'big') for chunk_type, payload in chunks if chunk_type in (b'fcTL', b'fdAT')]
+    assert sequence == list(range(len(sequence)))
+    delays = [(int.from_bytes(payload[20:22], 'big'), int.from_bytes(payload[22:24], 'big')) for chunk_type, payload in chunks if chunk_type == b'fcTL']
+    assert delays == [(1, 10), (2, 10), (1, 10)]
+    with Image.open(output) as im:
+        assert im.n_frames == 3
+        for i, path in enumerate(paths):
+            im.seek(i)
+            with Image.open(path) as frame: assert im.convert('RGBA').tobytes() == frame.convert('RGBA').tobytes()
+
+
+def test_write_apng_rejects_mismatched_frames(tmp_path):
+    first = _frames(tmp_path, 1)[0]
+    other = tmp_path / "other.png"
+    Image.new('RGBA', (8, 8)).save(other)
+    with pytest.raises(ValueError):
+        fe.write_apng(str(tmp_path / "anim.png"), [(first, 1), (str(other), 1)], 10)
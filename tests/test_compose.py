@@ -0,0 +1,59 @@
+import random
+
+import pytest
+from PIL import Image, ImageChops
+
+import feather_extractor as fe
+
+
+def _baseline_compose(frame_img, comp_settings):
+    """最初 module_3_compose 的逐帧合成: 每帧新建画布，以帧自身为蒙版粘贴"""
+    bg_alpha = int(255 * (comp_settings['bg_opacity'] / 100))
+    canvas = Image.new('RGBA', (comp_settings['width'], comp_settings['height']), (*fe.hex_to_rgb(comp_settings['bg_color']), bg_alpha))
+    canvas.paste(frame_img, ((canvas.width - frame_img.width) // 2, (canvas.height - frame_img.height) // 2), frame_img)
+    return canvas
+
+
+def _feathered_frame(size, seed=0):
+    """带随机颜色与完整 0-255 Alpha 渐变的测试帧"""
+    rng = random.Random(seed)
+    frame = Image.new('RGBA', size)
+    frame.putdata([(rng.randrange(256), rng.randrange(256), rng.randrange(256), (x * 255) // max(1, size[0] - 1)) for y in range(size[1]) for x in range(size[0])])
+    return frame
+
+
+def _comp(width, height, opacity, color='#336699'):
+    return {'enabled': True, 'width': width, 'height': height, 'bg_color': color, 'bg_opacity': opacity}
+
+
+@pytest.mark.parametrize('opacity', [0, 1, 50, 100])
+@pytest.mark.parametrize('canvas_size', [(40, 30), (24, 16), (20, 12), (17, 9)])
+def test_rgba_frame_matches_baseline_paste(opacity, canvas_size):
+    frame = _feathered_frame((20, 12))
+    comp = _comp(*canvas_size, opacity)
+    result = fe.compose_frame(frame, comp)
+    assert result.mode == 'RGBA' and result.size == canvas_size
+    assert ImageChops.difference(result, _baseline_compose(frame, comp)).getbbox() is None
+
+
+def test_feathered_edges_keep_baseline_alpha_on_transparent_canvas():
+    frame = Image.new('RGBA', (4, 4), (200, 100, 50, 128))
+    pixel = fe.compose_frame(frame, _comp(8, 8, 0)).getpixel((4, 4))
+    assert pixel == (126, 101, 101, 64) # Alpha 为 128²/255，颜色按 Alpha 在背景色 #336699 与帧之间插值
+
+
+@pytest.mark.parametrize('canvas_size', [(40, 30), (20, 12), (10, 6)])
+def test_opaque_frame_is_pasted_without_blending(canvas_size):
+    frame = _feathered_frame((20, 12)).convert('RGB')
+    comp = _comp(*canvas_size, 50)
+    result = fe.compose_frame(frame, comp)
+    expected = Image.new('RGBA', canvas_size, (0x33, 0x66, 0x99, 127))
+    expected.paste(frame, ((canvas_size[0] - 20) // 2, (canvas_size[1] - 12) // 2))
+    assert ImageChops.difference(result, expected).getbbox() is None
+
+
+def test_canvas_template_is_not_modified():
+    comp = _comp(30, 20, 40)
+    fe.compose_frame(_feathered_frame((10, 10)), comp)
+    template, _ = fe.get_canvas_template((10, 10), comp)
+    assert template.getcolors() == [(600, (0x33, 0x66, 0x99, 102))]
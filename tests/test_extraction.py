@@ -0,0 +1,125 @@
+import os
+
+import pytest
+
+import feather_extractor as fe
+from conftest import fake_metadata
+
+
+def _option(command, name):
+    return command[command.index(name) + 1]
+
+
+@pytest.mark.parametrize('duration, fps, segments', [(10.0, 25, 4), (10.0, 40, 3), (7.3, 30, 5), (2.5, 10, 8), (0.4, 10, 4), (100.0, 24, 1)])
+def test_plan_segments_covers_every_frame_once(duration, fps, segments):
+    plan = fe._plan_segments(duration, fps, segments)
+    assert plan[0][0] == 0 and plan[-1][1] is None
+    for (start, count), (next_start, _) in zip(plan, plan[1:]):
+        assert count > 0 and start + count == next_start
+    assert len(plan) <= max(1, int(duration * fps) // fps)
+
+
+def test_plan_segments_keeps_segments_at_least_one_second():
+    assert fe._plan_segments(2.0, 25, 8) == [(0, 25), (25, None)]
+    assert fe._plan_segments(0.5, 25, 4) == [(0, None)]
+
+
+def test_extract_command_whole_video(settings):
+    settings['extraction']['fps'] = 25
+    command = fe._extract_command(settings, ['-y', 'out/%06d.png'])
+    assert command[0] == 'ffmpeg' and '-ss' not in command and '-frames:v' not in command
+    assert _option(command, '-vf') == "fps=25,scale=750:-1" and command[-2:] == ['-y', 'out/%06d.png']
+
+
+def test_extract_command_segment_boundary(settings):
+    settings['extraction']['fps'] = 25
+    command = fe._extract_command(settings, ['-y', 'out/%06d.png'], start_frame=100, frame_count=50)
+    # 预读 25 帧 (1 秒)，从输出帧 75 的时间点开始解码，trim 丢掉预读帧后首帧即为第 100 帧
+    assert float(_option(command, '-ss')) == pytest.approx(3.0)
+    assert _option(command, '-vf') == "fps=25:start_time=0,trim=start_frame=25,scale=750:-1"
+    assert _option(command, '-frames:v') == '50'
+
+
+def test_extract_command_segment_inside_time_window(settings):
+    settings['extraction'].update(fps=10, start=2.5, end=8)
+    command = fe._extract_command(settings, ['-y', 'out/%06d.png'], start_frame=5, frame_count=None)
+    assert float(_option(command, '-ss')) == pytest.approx(2.5) and float(_option(command, '-t')) == pytest.approx(5.5)
+    assert _option(command, '-vf').startswith("fps=10:start_time=0,trim=start_frame=5,")
+
+
+def test_extract_command_selection_before_scale(settings):
+    settings['extraction'].update(select='nth', every_nth=3)
+    vf = _option(fe._extract_command(settings, ['-']), '-vf').split(',')
+    assert vf[0].startswith('select=') and vf[-1] == 'scale=750:-1'
+
+
+def test_extract_command_splits_threads_between_processes(settings):
+    settings['execution']['ffmpeg_threads'] = 8
+    command = fe._extract_command(settings, ['-'], processes=4)
+    assert _option(command, '-filter_threads') == '2' and command[command.index('-i') + 1:].count('-threads') == 1
+
+
+@pytest.mark.parametrize('value, expected', [
+    ("0,12,30-33", [0, 12, 30, 31, 32, 33]),
+    ("5，3, 3 ,,1-2", [1, 2, 3, 5]),
+    ([7, "1-3", 2], [1, 2, 3, 7]),
+    ("", []),
+])
+def test_parse_frame_list(value, expected):
+    assert fe.parse_frame_list(value) == expected
+
+
+@pytest.mark.parametrize('value', ["a,b", "-3", [True], [None], [1.5], 12])
+def test_parse_frame_list_rejects_invalid(value):
+    with pytest.raises((ValueError, TypeError)):
+        fe.parse_frame_list(value)
+
+
+def test_frame_runs_and_list_select(settings):
+    assert fe._frame_runs([0, 1, 2, 5, 7, 8]) == [(0, 2), (5, 5), (7, 8)]
+    settings['extraction'].update(select='list', frames=list(range(0, 12000)) + [20000])
+    _, filters, output_args = fe.extraction_plan(settings)
+    assert filters[0] == "select=between(n\\,0\\,11999)+eq(n\\,20000)"
+    assert output_args[-2:] == ['-frames:v', '12001']
+
+
+def test_long_filter_graph_goes_through_script_file(settings):
+    settings['extraction'].update(select='list', frames=list(range(0, 24000, 2)))
+    command = fe._extract_command(settings, ['-'])
+    assert '-vf' not in command
+    script_path = _option(command, '-filter_script:v')
+    with open(script_path, encoding='utf-8') as f: assert f.read().startswith("select=eq(n\\,0)+eq(n\\,2)")
+    os.remove(script_path)
+
+
+def test_extraction_window(fake_probe):
+    window = lambda **ext: fe.extraction_window({'extraction': ext}, 10.0)
+    assert window() == (0.0, None)
+    assert window(start=-1, end=None) == (0.0, None)
+    assert window(start=2, end=5) == (2.0, 5.0)
+    assert window(start=2, end=12) == (2.0, None) # 超出时长视为到结尾
+    assert fe.extraction_window({'extraction': {'start': 1, 'end': 30}}) == (1.0, 30.0) # 时长未知时保留终点
+
+
+def test_selection_error(settings, fake_probe):
+    assert fe.selection_error(settings) is None
+    settings['extraction'].update(start=12)
+    assert "超出视频时长" in fe.selection_error(settings)
+    settings['extraction'].update(start=3, end=2)
+    assert "必须晚于" in fe.selection_error(settings)
+    settings['extraction'].update(start=0, end=None, select='list', frames=[3, 1])
+    assert "升序" in fe.selection_error(settings)
+    settings['extraction']['frames'] = [1, 3]
+    assert fe.selection_error(settings) is None
+    fake_probe['metadata'] = fake_metadata(duration=None)
+    settings['extraction'].update(select='fps', start=100)
+    assert fe.selection_error(settings) is None
+
+
+def test_normalized_extraction_omits_defaults():
+    ext = {'fps': 40, 'segments': 4, 'start': 0, 'end': None, 'select': 'fps', 'every_nth': 2, 'frames': []}
+    assert fe._normalized_extraction(ext) == {'fps': 40}
+    assert fe._normalized_extraction({'fps': 40}) == {'fps': 40} # 旧版本配置没有选帧字段
+    assert fe._normalized_extraction({**ext, 'start': 1.5, 'end': 4}) == {'fps': 40, 'start': 1.5, 'end': 4}
+    assert fe._normalized_extraction({**ext, 'select': 'nth', 'frames': [1]}) == {'fps': 40, 'select': 'nth', 'every_nth': 2}
+    assert fe._normalized_extraction({**ext, 'select': 'list', 'frames': [1, 4]}) == {'fps': 40, 'select': 'list', 'frames': [1, 4]}
@@ -0,0 +1,68 @@
+import json
+import os
+
+import feather_extractor as fe
+
+
+def _write_frames(settings, count):
+    os.makedirs(settings['paths']['output'], exist_ok=True)
+    names = [fe.output_frame_name(fe.frame_filename(i), settings['output']) for i in range(count)]
+    for name in names:
+        with open(os.path.join(settings['paths']['output'], name), 'wb') as f: f.write(b'frame')
+    return names
+
+
+def test_manifest_key_ignores_execution_settings(settings):
+    key = fe.load_output_manifest(settings)['key']
+    settings['execution'].update(mode='stream', workers=4, report=True, ffmpeg_threads=2)
+    settings['extraction']['segments'] = 4
+    assert fe.load_output_manifest(settings)['key'] == key
+    settings['extraction']['fps'] = 12
+    assert fe.load_output_manifest(settings)['key'] != key
+
+
+def test_manifest_key_ignores_disabled_modules(settings):
+    settings['composition']['enabled'] = False
+    key = fe.load_output_manifest(settings)['key']
+    settings['composition']['bg_color'] = '#FF0000'
+    assert fe.load_output_manifest(settings)['key'] == key
+    settings['composition']['enabled'] = True
+    assert fe.load_output_manifest(settings)['key'] != key
+
+
+def test_manifest_key_follows_input_content(settings):
+    key = fe.load_output_manifest(settings)['key']
+    with open(settings['paths']['input'], 'ab') as f: f.write(b'more')
+    manifest = fe.load_output_manifest(settings)
+    assert manifest['key'] != key and manifest['input']['fingerprint'] == fe._file_fingerprint(settings['paths']['input'])
+
+
+def test_manifest_resume_keeps_frames_and_start_frame(settings):
+    names = _write_frames(settings, 5)
+    manifest = fe.load_output_manifest(settings)
+    manifest['done'].update(names[:3] + names[4:])
+    fe.save_output_manifest(manifest)
+    with open(manifest['path'], encoding='utf-8') as f: data = json.load(f)
+    assert set(data) == {'key', 'input', 'settings', 'status', 'frames'} and data['status'] == 'running'
+    resumed = fe.load_output_manifest(settings)
+    assert resumed['done'] == set(names[:3] + names[4:]) and resumed['status'] == 'running'
+    assert fe._resume_start_frame(settings, resumed) == 3 # 第一个未完成的帧
+    settings['dedup']['enabled'] = True
+    assert fe._resume_start_frame(settings, resumed) == 0
+    settings['dedup']['enabled'] = False
+    settings['extraction'].update(select='nth')
+    assert fe._resume_start_frame(settings, resumed) == 0
+    assert fe._resume_start_frame(settings, None) == 0
+
+
+def test_manifest_complete_and_stale_frames(settings):
+    names = _write_frames(settings, 3)
+    manifest = fe.load_output_manifest(settings)
+    manifest['done'].update(names)
+    fe.save_output_manifest(manifest, 'complete')
+    assert fe.load_output_manifest(settings)['status'] == 'complete'
+    os.remove(os.path.join(settings['paths']['output'], names[1]))
+    assert fe.load_output_manifest(settings)['status'] == 'running' # 成品帧缺失时不再视为完成
+    settings['scaling']['a_width'] = 320 # 键变化: 旧清单记录的帧被清除
+    manifest = fe.load_output_manifest(settings)
+    assert manifest['done'] == set() and not any(os.path.exists(os.path.join(settings['paths']['output'], name)) for name in names)